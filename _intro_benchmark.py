@@ -0,0 +1,166 @@
+"""
+    Benchmarks the addon's audio-fingerprint intro detector on a synthetic
+    season.
+
+    Every episode gets its own cold open and programme audio (chords and
+    percussive hits drawn from a per-episode seed) with the same intro spliced
+    in at a different offset, plus a little noise over everything. The
+    episodes are written as 8 kHz WAV files, so no ffmpeg is needed, and
+    the detector's intros are checked against the known splice points.
+    Reports accuracy and the per-episode cost of fingerprinting and
+    matching.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "repo", "repository.skipintro"))
+
+from resources.lib import fingerprint  # noqa: E402
+
+from _repo_generator import color_text  # noqa: E402
+
+RATE = fingerprint.SAMPLE_RATE
+
+
+def _tones(rng, seconds):
+    """
+    Returns ``seconds`` of random chords with harmonics and percussive noise
+    hits, a rough stand-in for a soundtrack.
+    """
+    out = np.zeros(int(seconds * RATE), dtype=np.float32)
+    position = 0
+    while position < len(out):
+        length = int(rng.uniform(0.15, 0.8) * RATE)
+        t = np.arange(length) / RATE
+        note = np.zeros(length, dtype=np.float32)
+        for _ in range(rng.integers(2, 5)):
+            freq = rng.uniform(100, 600)
+            for harmonic in range(1, 8):
+                if freq * harmonic < RATE / 2:
+                    note += np.sin(2 * np.pi * freq * harmonic * t) * rng.uniform(0.05, 0.3) / harmonic
+        if rng.random() < 0.5:
+            hit = min(length, int(0.05 * RATE))
+            note[:hit] += rng.normal(0, 0.5, hit) * np.linspace(1, 0, hit)
+        envelope = np.minimum(1.0, np.minimum(t, t[::-1]) * 40)
+        end = min(len(out), position + length)
+        out[position:end] += (note * envelope)[: end - position]
+        position = end
+    return out
+
+
+def make_season(folder, episodes=6, minutes=5, intro=40, noise=0.02, seed=0):
+    """
+    Writes a synthetic season to ``folder`` and returns [(path, intro start,
+    intro end)].
+    """
+    rng = np.random.default_rng(seed)
+    theme = _tones(rng, intro)
+    season = []
+    for episode in range(episodes):
+        cold_open = float(rng.uniform(0, 120))
+        audio = _tones(rng, minutes * 60)
+        start = int(cold_open * RATE)
+        audio[start:start + len(theme)] = theme
+        audio += rng.normal(0, noise, len(audio)).astype(np.float32)
+        pcm = np.clip(audio * 12000, -32768, 32767).astype("<i2")
+
+        path = os.path.join(folder, "S01E{:02d}.wav".format(episode + 1))
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes(pcm.tobytes())
+        season.append((path, cold_open, cold_open + intro))
+    return season
+
+
+def benchmark(episodes=6, minutes=5, intro=40, noise=0.02, seed=0, workers=1):
+    tmp = tempfile.mkdtemp(prefix="intro_benchmark_")
+    try:
+        season = make_season(tmp, episodes, minutes, intro, noise, seed)
+        paths = [path for path, _, _ in season]
+
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            start = time.perf_counter()
+            if executor:
+                fingerprints = list(executor.map(fingerprint.fingerprint_file, paths, [minutes * 60] * len(paths)))
+            else:
+                fingerprints = [fingerprint.fingerprint_file(path, minutes * 60) for path in paths]
+            fingerprint_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            intros = fingerprint.detect_intros(fingerprints, executor)
+            match_seconds = time.perf_counter() - start
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    errors = []
+    found = 0
+    for (_, expected_start, expected_end), detected in zip(season, intros):
+        if detected is None:
+            continue
+        found += 1
+        errors.append(max(abs(detected[0] - expected_start), abs(detected[1] - expected_end)))
+    return {
+        "episodes": episodes,
+        "found": found,
+        "max_error_s": max(errors) if errors else None,
+        "mean_error_s": sum(errors) / len(errors) if errors else None,
+        "fingerprint_s_per_episode": fingerprint_seconds / episodes,
+        "match_s_per_episode": match_seconds / episodes,
+        "fingerprint_words_per_episode": int(np.mean([len(f) for f in fingerprints])),
+        "fingerprint_bytes_per_episode": int(np.mean([f.nbytes for f in fingerprints])),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark intro detection on a synthetic season.")
+    parser.add_argument("--episodes", type=int, default=6)
+    parser.add_argument("--minutes", type=float, default=5, help="length of each episode")
+    parser.add_argument("--intro", type=float, default=40, help="length of the intro in seconds")
+    parser.add_argument("--noise", type=float, default=0.02, help="noise amplitude over the audio")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.episodes, args.minutes, args.intro, args.noise, args.seed, args.workers or os.cpu_count())
+    accurate = results["found"] == results["episodes"] and results["max_error_s"] < 1.0
+    print(
+        "found {}/{} intros, max error {}, mean error {}".format(
+            results["found"],
+            results["episodes"],
+            color_text("{:.2f}s".format(results["max_error_s"] or 0), "green" if accurate else "red"),
+            "{:.2f}s".format(results["mean_error_s"] or 0),
+        )
+    )
+    print(
+        "per episode: fingerprint {:.3f}s, match {:.3f}s, {} words ({} bytes)".format(
+            results["fingerprint_s_per_episode"],
+            results["match_s_per_episode"],
+            results["fingerprint_words_per_episode"],
+            results["fingerprint_bytes_per_episode"],
+        )
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
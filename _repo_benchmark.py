@@ -0,0 +1,281 @@
+"""
+    Benchmarks _repo_generator.Generator against a synthetic release tree.
+
+    A throwaway tree with a configurable number of addons, files per addon,
+    file sizes and asset mix is generated in a temporary folder. Each stage
+    of the generator is timed for a cold build (nothing cached), a warm
+    build (nothing changed) and an incremental build (a few addons edited).
+    Results can be appended to a JSON file so runs can be compared over time.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from _repo_generator import Generator, color_text, convert_bytes
+
+MODES = ["cold", "warm", "incremental"]
+_WORDS = [
+    "xbmc", "player", "intro", "chapter", "skip", "dialog", "setting", "addon",
+    "def", "return", "self", "import", "video", "time", "monitor", "log",
+]
+
+
+def _text(rng, size):
+    """
+    Returns ``size`` bytes of compressible, source-like text.
+    """
+    out = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 10))) + "\n"
+        out.append(line)
+        length += len(line)
+    return "".join(out).encode("utf-8")[:size]
+
+
+def make_tree(
+    release_path,
+    addons=100,
+    files=10,
+    file_size=8 * 1024,
+    binary_ratio=0.2,
+    icon_size=32 * 1024,
+    fanart_size=256 * 1024,
+    seed=0,
+):
+    """
+    Creates a synthetic release tree and returns its total size in bytes.
+    Binary files and art are random bytes, so they don't compress.
+    """
+    rng = random.Random(seed)
+    total = 0
+    for i in range(addons):
+        addon_id = "plugin.video.bench{:05d}".format(i)
+        addon_folder = os.path.join(release_path, addon_id)
+        os.makedirs(os.path.join(addon_folder, "resources", "lib"))
+
+        contents = {
+            "addon.xml": (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<addon id="{0}" name="Bench {1}" version="1.0.0" provider-name="bench">\n'
+                '    <extension point="xbmc.python.pluginsource" library="default.py"/>\n'
+                '    <extension point="xbmc.addon.metadata">\n'
+                '        <summary lang="en">Synthetic addon {1}</summary>\n'
+                "        <assets>\n"
+                "            <icon>icon.png</icon>\n"
+                "            <fanart>fanart.jpg</fanart>\n"
+                "        </assets>\n"
+                "    </extension>\n"
+                "</addon>\n".format(addon_id, i)
+            ).encode("utf-8"),
+            "icon.png": rng.randbytes(icon_size),
+            "fanart.jpg": rng.randbytes(fanart_size),
+        }
+        for n in range(files):
+            if rng.random() < binary_ratio:
+                contents["resources/media/{}.bin".format(n)] = rng.randbytes(file_size)
+            else:
+                contents["resources/lib/module{}.py".format(n)] = _text(rng, file_size)
+
+        for relpath, data in contents.items():
+            path = os.path.join(addon_folder, relpath)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(data)
+            total += len(data)
+    return total
+
+
+def touch_tree(release_path, fraction=0.01, seed=1):
+    """
+    Appends a line to one module of ``fraction`` of the addons and returns
+    how many were edited.
+    """
+    rng = random.Random(seed)
+    folders = sorted(
+        f for f in os.listdir(release_path) if f.startswith("plugin.video.bench")
+    )
+    edited = rng.sample(folders, max(1, int(len(folders) * fraction)))
+    for folder in edited:
+        lib = os.path.join(release_path, folder, "resources", "lib")
+        modules = sorted(os.listdir(lib)) or ["module0.py"]
+        with open(os.path.join(lib, modules[0]), "a") as f:
+            f.write("# edited\n")
+    return len(edited)
+
+
+def _output_bytes(zips_path):
+    total = 0
+    for root, _, files in os.walk(zips_path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def run_build(release_path, input_bytes, addons, executor=None):
+    """
+    Runs one build and returns its timings and throughput. Stage CPU times
+    include the worker processes; the build's own ``cpu_seconds`` does not.
+    """
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator = Generator(release_path, executor=executor)
+    total = time.perf_counter() - start
+
+    return {
+        "seconds": total,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "stages": generator.stats.stages,
+        "file_types": generator.stats.file_types,
+        "input_bytes": input_bytes,
+        "output_bytes": _output_bytes(os.path.join(release_path, "zips")),
+        "addons_per_s": addons / total if total else None,
+        "mb_per_s": input_bytes / (1024 * 1024) / total if total else None,
+    }
+
+
+def benchmark(params, modes=MODES, workers=1):
+    """
+    Builds a synthetic tree from ``params`` and runs each build mode on it.
+    """
+    results = {}
+    tmp = tempfile.mkdtemp(prefix="repo_benchmark_")
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        release_path = os.path.join(tmp, "repo")
+        input_bytes = make_tree(release_path, **params)
+        addons = params["addons"]
+
+        for mode in modes:
+            if mode == "cold":
+                for name in ("zips", ".build_cache"):
+                    shutil.rmtree(os.path.join(release_path, name), ignore_errors=True)
+            elif mode == "incremental":
+                touch_tree(release_path)
+            results[mode] = run_build(release_path, input_bytes, addons, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def _print_results(results):
+    for mode, result in results.items():
+        print(
+            "{}: {:.3f}s ({:.3f}s CPU) - {:.1f} addons/s, {:.2f} MB/s, {} -> {}".format(
+                color_text(mode, 'cyan'),
+                result["seconds"],
+                result["cpu_seconds"],
+                result["addons_per_s"] or 0,
+                result["mb_per_s"] or 0,
+                convert_bytes(result["input_bytes"]),
+                convert_bytes(result["output_bytes"]),
+            )
+        )
+        for stage, counters in sorted(
+            result["stages"].items(), key=lambda item: -item[1]["wall"]
+        ):
+            print(
+                "    {:<16} {:>9.4f}s wall {:>9.4f}s cpu {:>6} calls".format(
+                    stage, counters["wall"], counters["cpu"], counters["calls"]
+                )
+            )
+
+
+def _compare(previous, results):
+    for mode, result in results.items():
+        before = previous["results"].get(mode)
+        if not before or not before["seconds"]:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        color = "green" if ratio <= 1.0 else "red"
+        print(
+            "{} vs {}: {}".format(
+                color_text(mode, 'cyan'),
+                previous["timestamp"],
+                color_text("{:.2f}x".format(ratio), color),
+            )
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the repo generator on a synthetic release tree."
+    )
+    parser.add_argument("--addons", type=int, default=100)
+    parser.add_argument("--files", type=int, default=10, help="files per addon")
+    parser.add_argument(
+        "--file-size", type=int, default=8, help="size of each file in KB"
+    )
+    parser.add_argument(
+        "--binary-ratio",
+        type=float,
+        default=0.2,
+        help="fraction of files that are incompressible",
+    )
+    parser.add_argument("--icon-size", type=int, default=32, help="icon.png size in KB")
+    parser.add_argument(
+        "--fanart-size", type=int, default=256, help="fanart.jpg size in KB"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="JSON file to append this run to; the last run with the same "
+        "parameters is printed for comparison",
+    )
+    args = parser.parse_args(argv)
+
+    params = {
+        "addons": args.addons,
+        "files": args.files,
+        "file_size": args.file_size * 1024,
+        "binary_ratio": args.binary_ratio,
+        "icon_size": args.icon_size * 1024,
+        "fanart_size": args.fanart_size * 1024,
+        "seed": args.seed,
+    }
+    workers = args.workers or os.cpu_count()
+    results = benchmark(params, args.modes, workers)
+    _print_results(results)
+
+    if args.output:
+        run = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "workers": workers,
+            "params": params,
+            "results": results,
+        }
+        runs = []
+        if os.path.exists(args.output):
+            with open(args.output, "r", encoding="utf-8") as f:
+                runs = json.load(f)
+        previous = [
+            r for r in runs if r["params"] == params and r["workers"] == workers
+        ]
+        if previous:
+            _compare(previous[-1], results)
+        runs.append(run)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(runs, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+    Assertion-based checks for _repo_generator.Generator, run against
+    synthetic release trees in a temporary folder.
+
+    Each check raises AssertionError on failure; the script exits non-zero
+    if any check fails.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from xml.etree import ElementTree
+
+from _repo_benchmark import make_tree
+from _repo_generator import ArtifactStore, Generator, color_text
+
+
+def _build(release_path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Generator(release_path, **kwargs)
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def check_store_no_reproducible(tmp):
+    """
+    A --no-reproducible rebuild of one release must not write through the
+    store links it shares with another release.
+    """
+    store = ArtifactStore(os.path.join(tmp, "store"))
+    releases = [os.path.join(tmp, name) for name in ("repo", "leia")]
+    for release in releases:
+        make_tree(release, addons=2, files=4, fanart_size=4 * 1024)
+        _build(release, store=store)
+
+    zip_name = os.path.join(
+        "zips", "plugin.video.bench00000", "plugin.video.bench00000-1.0.0.zip"
+    )
+    repo_zip, leia_zip = (os.path.join(release, zip_name) for release in releases)
+    assert os.path.samefile(repo_zip, leia_zip), "identical zips aren't shared"
+    leia_sha256 = _sha256(leia_zip)
+
+    with open(
+        os.path.join(releases[0], "plugin.video.bench00000", "addon.xml"), "a"
+    ) as f:
+        f.write("<!-- edited -->\n")
+    _build(releases[0], store=store, reproducible=False)
+
+    assert not os.path.samefile(repo_zip, leia_zip), "rebuilt zip is still linked"
+    assert _sha256(leia_zip) == leia_sha256, "the other release's zip was rewritten"
+    assert _read(leia_zip + ".sha256") == leia_sha256
+    assert _read(repo_zip + ".sha256") == _sha256(repo_zip)
+    stored = [
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(store.root)
+        for name in names
+        if not name.endswith((".tmp", ".checksums"))
+    ]
+    for path in stored:
+        recorded = store.checksums(os.path.basename(path))
+        if recorded is not None:
+            assert recorded["sha256"] == _sha256(path), "stored checksums are stale"
+
+
+def check_store_prune(tmp):
+    """
+    Objects no release links to any more are pruned; linked ones are kept.
+    """
+    store = ArtifactStore(os.path.join(tmp, "store"))
+    releases = [os.path.join(tmp, name) for name in ("repo", "leia")]
+    for release in releases:
+        make_tree(release, addons=2, files=4, fanart_size=4 * 1024)
+        _build(release, store=store)
+    zips_folders = [os.path.join(release, "zips") for release in releases]
+    assert store.prune(zips_folders) == 0, "linked objects were pruned"
+
+    # edit the same module in both releases, orphaning the shared zip
+    for release in releases:
+        lib = os.path.join(release, "plugin.video.bench00000", "resources", "lib")
+        with open(os.path.join(lib, sorted(os.listdir(lib))[0]), "a") as f:
+            f.write("# edited\n")
+        _build(release, store=store)
+    assert store.prune(zips_folders) == 1, "the orphaned zip wasn't pruned"
+    assert store.prune(zips_folders) == 0
+
+    # every published zip still comes from the store
+    for release in releases:
+        _build(release, store=store)
+        for dirpath, _, names in os.walk(os.path.join(release, "zips")):
+            for name in names:
+                if name.endswith(".zip"):
+                    assert os.stat(os.path.join(dirpath, name)).st_nlink > 1
+
+
+def check_unreadable_entries(tmp):
+    """
+    A dangling symlink (an editor's lockfile) and a symlink loop inside an
+    addon are skipped; the addon is still packaged.
+    """
+    release = os.path.join(tmp, "repo")
+    make_tree(release, addons=2, files=2, fanart_size=4 * 1024)
+    addon = os.path.join(release, "plugin.video.bench00000")
+    os.symlink("agent@host.1234:1700000000", os.path.join(addon, ".#addon.xml"))
+    os.symlink("..", os.path.join(addon, "resources", "loop"))
+    generator = _build(release)
+
+    files = generator._index.folders["plugin.video.bench00000"]
+    assert ".#addon.xml" not in files
+    assert not any(path.startswith("resources/loop") for path in files)
+    for i in range(2):
+        assert os.path.exists(
+            os.path.join(
+                release,
+                "zips",
+                "plugin.video.bench{:05d}".format(i),
+                "plugin.video.bench{:05d}-1.0.0.zip".format(i),
+            )
+        ), "addon {} wasn't packaged".format(i)
+
+
+def _merge_seconds(release_path, addons):
+    """
+    Builds a synthetic tree of ``addons`` addons, bumps the version of every
+    tenth one and returns how long a fresh generator took to rebuild it.
+    Packaging is stubbed out, so only scanning and the addons.xml merge are
+    timed.
+    """
+    make_tree(
+        release_path,
+        addons=addons,
+        files=1,
+        file_size=64,
+        binary_ratio=0,
+        icon_size=16,
+        fanart_size=16,
+    )
+
+    def build():
+        generator = Generator(release_path, build=False)
+        generator._package_addons = lambda packages: set()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.build()
+        return time.perf_counter() - start
+
+    build()
+    bumped = set()
+    for i in range(0, addons, 10):
+        addon_id = "plugin.video.bench{:05d}".format(i)
+        path = os.path.join(release_path, addon_id, "addon.xml")
+        with open(path, "r") as f:
+            data = f.read()
+        with open(path, "w") as f:
+            f.write(data.replace('version="1.0.0"', 'version="1.0.1"', 1))
+        bumped.add(addon_id)
+    seconds = build()
+
+    root = ElementTree.parse(os.path.join(release_path, "zips", "addons.xml")).getroot()
+    ids = [entry.get("id") for entry in root]
+    assert len(ids) == addons, "addons.xml has {} of {} addons".format(len(ids), addons)
+    assert ids == sorted(ids), "addons.xml isn't sorted"
+    assert len(set(ids)) == addons, "addons.xml has duplicate entries"
+    for entry in root:
+        expected = "1.0.1" if entry.get("id") in bumped else "1.0.0"
+        assert entry.get("version") == expected, "{} wasn't updated".format(entry.get("id"))
+    return seconds
+
+
+def check_merge_scales(tmp):
+    """
+    Rebuilding 10k addons with a tenth of them bumped gives a complete,
+    sorted addons.xml, and takes roughly ten times as long as 1k addons,
+    not the hundred times a quadratic merge would.
+    """
+    small = _merge_seconds(os.path.join(tmp, "small"), 1000)
+    large = _merge_seconds(os.path.join(tmp, "large"), 10000)
+    assert large < 25 * small, "10k addons took {:.2f}s, 1k took {:.2f}s".format(
+        large, small
+    )
+
+
+CHECKS = [
+    check_store_no_reproducible,
+    check_store_prune,
+    check_unreadable_entries,
+    check_merge_scales,
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the repo generator checks.")
+    parser.add_argument(
+        "-k", dest="pattern", default="", help="only run checks whose name contains this"
+    )
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for check in CHECKS:
+        if args.pattern not in check.__name__:
+            continue
+        tmp = tempfile.mkdtemp(prefix="repo_checks_")
+        try:
+            check(tmp)
+            print("{} {}".format(color_text("ok", 'green'), check.__name__))
+        except Exception:
+            failed += 1
+            print("{} {}".format(color_text("FAIL", 'red'), check.__name__))
+            traceback.print_exc()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,15 +4,61 @@
     and then update the md5 and addons.xml file
 """
 
+import argparse
+import contextlib
+import cProfile
+import errno
+import gzip
 import hashlib
+import json
 import os
 import shutil
 import sys
+import time
 import zipfile
 
+from concurrent.futures import ProcessPoolExecutor
 from xml.etree import ElementTree
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 SCRIPT_VERSION = 5
+MANIFEST_VERSION = 1
+CACHE_DIR = ".build_cache"
+# fixed metadata used for reproducible zips
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+ZIP_COMPRESSLEVEL = 6
+# checksum sidecars written next to every zip
+ZIP_CHECKSUMS = ("md5", "sha256")
+# repo-wide list of zip checksums, in sha256sum's format
+CHECKSUMS_MANIFEST = "checksums.sha256"
+# formats that are already compressed, so deflating them only burns CPU
+STORED_EXTENSIONS = [
+    ".jpg", ".jpeg", ".png", ".gif", ".webp",
+    ".zip", ".gz", ".bz2", ".xz", ".7z",
+    ".mp3", ".mp4", ".m4a", ".aac", ".ogg", ".flac", ".mkv",
+]
+# artwork the image optimizer recompresses
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+# largest size (width, height) Kodi shows each kind of artwork at
+IMAGE_LIMITS = {
+    "icon": (512, 512),
+    "fanart": (1920, 1080),
+    "screenshot": (1920, 1080),
+    "banner": (1000, 185),
+    "clearlogo": (800, 310),
+    "poster": (1000, 1500),
+}
+# Linux ioctl that makes a copy-on-write clone of a file (a reflink)
+FICLONE = 0x40049409
 KODI_VERSIONS = ["krypton", "leia", "matrix", "nexus", "repo"]
 IGNORE = [
     ".git",
@@ -121,6 +167,559 @@ def color_text(text, color):
     )
 
 
+def hash_file(path, algorithm="sha256"):
+    """
+    Return the hex digest of a file's contents.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(src, dst):
+    """
+    Clones ``src`` to ``dst`` where the filesystem supports it (btrfs, xfs).
+    Raises OSError otherwise.
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported here")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def link_or_copy(src, dst, link=True):
+    """
+    Places ``src`` at ``dst`` as a hardlink, a reflink, or failing both, a
+    copy. The file is swapped in atomically, so an existing ``dst`` that is
+    itself a link is replaced rather than written through.
+    """
+    tmp = dst + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        if not link:
+            raise OSError(errno.EPERM, "linking disabled")
+        os.link(src, tmp)
+    except OSError:
+        try:
+            _reflink(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for build artifacts, shared by every release.
+    Objects are kept under ``root/<key[:2]>/<key>`` and linked into place
+    with link_or_copy.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, src, move=False):
+        """
+        Adds ``src`` under ``key`` (moving it when ``move`` is set) and
+        returns the object's path.
+        """
+        path = self.path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if move:
+            os.replace(src, path)
+        elif not os.path.exists(path):
+            # copy under a unique name first, in case another worker is
+            # storing the same object
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            shutil.copy2(src, tmp)
+            os.replace(tmp, path)
+        return path
+
+    def put_checksums(self, key, checksums):
+        """
+        Records the {algorithm: hex digest} of the object ``key``.
+        """
+        tmp = "{}.checksums.{}.tmp".format(self.path(key), os.getpid())
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(checksums, f, sort_keys=True)
+        os.replace(tmp, self.path(key) + ".checksums")
+
+    def checksums(self, key):
+        """
+        Returns the checksums recorded for ``key``, or None.
+        """
+        try:
+            with open(self.path(key) + ".checksums", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def link(self, key, dst):
+        """
+        Links the object ``key`` to ``dst``. Returns False if ``dst``
+        already was that object.
+        """
+        path = self.path(key)
+        if os.path.exists(dst) and os.path.samefile(path, dst):
+            return False
+        link_or_copy(path, dst)
+        return True
+
+    def prune(self, folders):
+        """
+        Removes the objects that no file under ``folders`` is a link to, and
+        returns how many were removed. Objects that were copied rather than
+        linked into place count as unused, and are simply rebuilt when next
+        needed.
+        """
+        linked = set()
+        for folder in folders:
+            for dirpath, _, filenames in os.walk(folder):
+                for name in filenames:
+                    try:
+                        st = os.stat(os.path.join(dirpath, name))
+                    except OSError:
+                        continue
+                    linked.add((st.st_dev, st.st_ino))
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith((".tmp", ".checksums")):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                    if (st.st_dev, st.st_ino) in linked:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                if os.path.exists(path + ".checksums"):
+                    os.remove(path + ".checksums")
+                removed += 1
+        return removed
+
+
+class HashingWriter:
+    """
+    File-like wrapper that hashes everything written through it, so a
+    checksum is available as soon as the file is written.
+
+    It can't seek or tell, so a ZipFile writing through it streams each
+    entry with a data descriptor instead of going back to patch the entry's
+    header, and the bytes hashed are exactly the bytes in the file.
+    """
+
+    def __init__(self, f, algorithms=("md5",)):
+        self._f = f
+        self._digests = {name: hashlib.new(name) for name in algorithms}
+
+    def write(self, data):
+        for digest in self._digests.values():
+            digest.update(data)
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def hexdigest(self, algorithm):
+        return self._digests[algorithm].hexdigest()
+
+    def hexdigests(self):
+        return {name: digest.hexdigest() for name, digest in self._digests.items()}
+
+
+class CompressionPolicy:
+    """
+    Decides how each file is stored in an addon zip.
+
+    Extensions in ``stored`` are written uncompressed. Otherwise the deflate
+    level comes from ``levels`` (extension -> level), then from the first
+    ``size_levels`` entry (max size in bytes, level) the file fits in, and
+    finally from ``level``. A level of 0 stores the file.
+    """
+
+    def __init__(self, level=ZIP_COMPRESSLEVEL, levels=None, stored=None, size_levels=()):
+        self.level = level
+        self.levels = {ext.lower(): lvl for ext, lvl in (levels or {}).items()}
+        self.stored = {
+            ext.lower() for ext in (STORED_EXTENSIONS if stored is None else stored)
+        }
+        self.size_levels = sorted(size_levels)
+
+    def choose(self, relpath, size):
+        """
+        Returns (compress_type, compresslevel) for a file.
+        """
+        ext = file_type(relpath)
+        if ext in self.stored:
+            return zipfile.ZIP_STORED, None
+        level = self.levels.get(ext)
+        if level is None:
+            level = next(
+                (lvl for max_size, lvl in self.size_levels if size <= max_size),
+                self.level,
+            )
+        if level == 0:
+            return zipfile.ZIP_STORED, None
+        return zipfile.ZIP_DEFLATED, level
+
+    def key(self):
+        """
+        Returns a stable description of the policy, used to tell when zips
+        built under a different policy need rebuilding.
+        """
+        return json.dumps(
+            [self.level, sorted(self.levels.items()), sorted(self.stored), self.size_levels]
+        )
+
+
+class ImageOptimizer:
+    """
+    Recompresses the artwork copied next to each zip.
+
+    Images larger than their asset's entry in ``limits`` (asset tag ->
+    (width, height)) are scaled down, JPEGs are re-encoded at ``quality``
+    and PNGs are re-optimized; the result is only used when it was scaled
+    or is smaller. Each width in ``variants`` also gets a size-capped
+    ``<name>-<width>w<ext>`` copy.
+
+    Results are kept in ``cache`` (an ArtifactStore) under a hash of the
+    source image and the settings, so an unchanged image is only processed
+    once. Needs Pillow; see ``available``.
+    """
+
+    def __init__(self, cache, quality=85, limits=None, variants=()):
+        self.cache = cache
+        self.quality = quality
+        self.limits = dict(IMAGE_LIMITS if limits is None else limits)
+        self.variants = sorted(set(variants))
+
+    @staticmethod
+    def available():
+        return Image is not None
+
+    def key(self):
+        """
+        Returns a stable description of the settings, used to tell when
+        the published images need redoing.
+        """
+        return json.dumps(
+            [self.quality, sorted(self.limits.items()), self.variants]
+        )
+
+    def outputs(self, tag, dst):
+        """
+        Returns the (path, max size) of every image published for an
+        asset, starting with ``dst`` itself.
+        """
+        name, ext = os.path.splitext(dst)
+        outputs = [(dst, self.limits.get(tag))]
+        for width in self.variants:
+            outputs.append(("{}-{}w{}".format(name, width, ext), (width, 1 << 16)))
+        return outputs
+
+    def optimize(self, src, source_hash, tag, dst):
+        """
+        Publishes the optimized image for ``src`` at ``dst``, along with its
+        variants, and returns the number of bytes published.
+        """
+        written = 0
+        for path, box in self.outputs(tag, dst):
+            key = hashlib.sha256(
+                json.dumps(["image", source_hash, self.quality, box]).encode("utf-8")
+            ).hexdigest()
+            if not self.cache.has(key):
+                tmp = "{}.{}.tmp".format(self.cache.path(key), os.getpid())
+                if not os.path.exists(os.path.dirname(tmp)):
+                    os.makedirs(os.path.dirname(tmp), exist_ok=True)
+                try:
+                    processed = self._process(src, box, tmp)
+                except OSError:
+                    # not an image Pillow can read; publish it untouched
+                    processed = False
+                if not processed:
+                    shutil.copy2(src, tmp)
+                self.cache.put(key, tmp, move=True)
+            self.cache.link(key, path)
+            written += os.path.getsize(path)
+        return written
+
+    def _process(self, src, box, dst):
+        """
+        Writes the recompressed image to ``dst``. Returns False, leaving
+        ``dst`` alone, when the source is the better image.
+        """
+        with Image.open(src) as image:
+            format = image.format
+            if format not in ("JPEG", "PNG"):
+                return False
+            scaled = box is not None and (image.width > box[0] or image.height > box[1])
+            if scaled:
+                image.thumbnail(box, Image.LANCZOS)
+            options = {"optimize": True}
+            if image.info.get("icc_profile"):
+                options["icc_profile"] = image.info["icc_profile"]
+            if format == "JPEG":
+                options.update(quality=self.quality, progressive=True)
+            image.save(dst, format, **options)
+        if scaled or os.path.getsize(dst) < os.path.getsize(src):
+            return True
+        os.remove(dst)
+        return False
+
+
+class BuildStats:
+    """
+    Collects wall/CPU time, bytes read and written and file counts for each
+    build stage, both in total and per addon, and per file type for the
+    compression stage (``bytes_written`` there is the compressed size).
+    """
+
+    FIELDS = ("wall", "cpu", "calls", "files", "bytes_read", "bytes_written")
+
+    def __init__(self):
+        self.stages = {}
+        self.addons = {}
+        self.file_types = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, addon=None, file_type=None):
+        """
+        Times the enclosed block as ``name``. The yielded dict can be used to
+        record ``files``, ``bytes_read`` and ``bytes_written``.
+        """
+        counters = {"files": 0, "bytes_read": 0, "bytes_written": 0}
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield counters
+        finally:
+            counters["wall"] = time.perf_counter() - wall
+            counters["cpu"] = time.process_time() - cpu
+            counters["calls"] = 1
+            if file_type is not None:
+                self._add(self.file_types, file_type, counters)
+            else:
+                self._add(self.stages, name, counters)
+            if addon is not None:
+                self._add(self.addons.setdefault(addon, {}), name, counters)
+
+    @classmethod
+    def _add(cls, target, name, counters):
+        totals = target.setdefault(name, dict.fromkeys(cls.FIELDS, 0))
+        for field in cls.FIELDS:
+            totals[field] += counters[field]
+
+    def merge(self, other):
+        """
+        Adds the stages of another BuildStats (e.g. from a worker) to this one.
+        """
+        for name, counters in other.stages.items():
+            self._add(self.stages, name, counters)
+        for addon, stages in other.addons.items():
+            for name, counters in stages.items():
+                self._add(self.addons.setdefault(addon, {}), name, counters)
+        for file_type, counters in other.file_types.items():
+            self._add(self.file_types, file_type, counters)
+
+    @classmethod
+    def from_report(cls, report):
+        stats = cls()
+        stats.stages = report["stages"]
+        stats.addons = report["addons"]
+        stats.file_types = report.get("file_types", {})
+        return stats
+
+    def report(self, slowest=10):
+        """
+        Returns a JSON-serializable report, including the ``slowest`` addons.
+        """
+        addon_wall = {
+            addon: sum(counters["wall"] for counters in stages.values())
+            for addon, stages in self.addons.items()
+        }
+        file_types = {
+            file_type: dict(
+                counters,
+                ratio=counters["bytes_written"] / counters["bytes_read"]
+                if counters["bytes_read"]
+                else None,
+            )
+            for file_type, counters in self.file_types.items()
+        }
+        return {
+            "stages": self.stages,
+            "addons": self.addons,
+            "file_types": file_types,
+            "slowest_addons": sorted(addon_wall, key=addon_wall.get, reverse=True)[
+                :slowest
+            ],
+        }
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+    def print_summary(self):
+        for name, counters in sorted(
+            self.stages.items(), key=lambda item: -item[1]["wall"]
+        ):
+            print(
+                "{:<18} {:>9.3f}s wall {:>9.3f}s cpu {:>7} files {:>10} read {:>10} written".format(
+                    name,
+                    counters["wall"],
+                    counters["cpu"],
+                    counters["files"],
+                    convert_bytes(counters["bytes_read"]),
+                    convert_bytes(counters["bytes_written"]),
+                )
+            )
+        if self.file_types:
+            print("compress by file type:")
+        for file_type, counters in sorted(
+            self.file_types.items(), key=lambda item: -item[1]["wall"]
+        ):
+            print(
+                "  {:<16} {:>9.3f}s wall {:>7} files {:>10} -> {:>10} ({:.0%})".format(
+                    file_type or "(none)",
+                    counters["wall"],
+                    counters["files"],
+                    convert_bytes(counters["bytes_read"]),
+                    convert_bytes(counters["bytes_written"]),
+                    counters["bytes_written"] / counters["bytes_read"]
+                    if counters["bytes_read"]
+                    else 1,
+                )
+            )
+
+
+class TreeIndex:
+    """
+    Snapshot of a release tree taken with a single os.scandir pass.
+
+    ``folders`` maps each top-level folder to a dict of ``{relative path:
+    os.stat_result}`` for the files that belong in its zip (relative paths
+    use "/"). Anything listed in IGNORE is left out, and compiled Python
+    files and __pycache__ folders are collected separately for removal.
+    """
+
+    def __init__(self, root, exclude=()):
+        self.root = root
+        self.folders = {}
+        self.compiled_files = []
+        self.compiled_dirs = []
+
+        with os.scandir(root) as entries:
+            for entry in entries:
+                # a symlinked addon folder is still packaged, as before; only
+                # symlinks inside addons are left alone
+                if (
+                    entry.is_dir()
+                    and entry.name not in exclude
+                    and not entry.name.startswith(".")
+                ):
+                    files = {}
+                    self._scan(entry.path, "", files)
+                    self.folders[entry.name] = files
+
+    def _scan(self, path, prefix, files):
+        # files can vanish mid-scan and symlinks can dangle (an editor's
+        # lockfile is both), so unreadable entries are skipped, not fatal
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as e:
+            self._skip(path, e)
+            return
+        for entry in entries:
+            name = entry.name
+            try:
+                if entry.is_dir():
+                    # like os.walk, symlinked folders aren't descended into,
+                    # so a symlink loop can't recurse forever
+                    if entry.is_dir(follow_symlinks=False):
+                        if "pycache" in name.lower():
+                            self.compiled_dirs.append(entry.path)
+                        elif name not in IGNORE:
+                            self._scan(entry.path, prefix + name + "/", files)
+                elif name.lower().endswith(("pyo", "pyc")):
+                    self.compiled_files.append(entry.path)
+                elif not any(name.startswith(i) for i in IGNORE):
+                    files[prefix + name] = entry.stat()
+            except OSError as e:
+                self._skip(entry.path, e)
+
+    @staticmethod
+    def _skip(path, error):
+        print(
+            "Skipping {}: {}".format(
+                color_text(path, 'yellow'), color_text(error, 'red')
+            )
+        )
+
+    def refresh(self, folders):
+        """
+        Rescans only the given top-level folders, dropping those that no
+        longer exist. The compiled file lists then only cover these folders.
+        """
+        self.compiled_files = []
+        self.compiled_dirs = []
+        for folder in folders:
+            path = os.path.join(self.root, folder)
+            if os.path.isdir(path):
+                files = {}
+                self._scan(path, "", files)
+                self.folders[folder] = files
+            else:
+                self.folders.pop(folder, None)
+
+    def addons(self):
+        """
+        Returns the sorted names of the folders that contain an addon.xml.
+        """
+        return sorted(
+            folder for folder, files in self.folders.items() if "addon.xml" in files
+        )
+
+
+def file_type(path):
+    """
+    Returns the lowercased extension of ``path``, e.g. ".png".
+    """
+    return os.path.splitext(path)[1].lower()
+
+
+def set_compression(info, compress_type, level):
+    """
+    Sets how ``ZipFile.open(info, "w")`` compresses the entry. The level is
+    a public ZipInfo attribute (``compress_level``) only since Python 3.13;
+    3.7 to 3.12 read the private ``_compresslevel`` slot instead, which 3.13
+    keeps as an alias. ZipFile.write and writestr take a public level, but
+    the first stamps the entry with the file's own mtime and mode and the
+    second needs the whole file in memory.
+    """
+    info.compress_type = compress_type
+    if hasattr(info, "compress_level"):
+        info.compress_level = level
+    else:
+        info._compresslevel = level
+
+
 def convert_bytes(num):
     """
     this function will convert bytes to MB.... GB... etc
@@ -136,113 +735,449 @@ class Generator:
     Generates a new addons.xml file from each addons addon.xml file
     and a new addons.xml.md5 hash file. Must be run from the root of
     the checked-out repo.
+
+    Packaging (zipping and copying meta files) can be spread across a
+    process pool by passing an ``executor``; the addons.xml merge is
+    always done in this process so its output stays deterministic.
+
+    A build manifest in ``<release>/.build_cache`` records the size, mtime
+    and content hash of every packaged file, so only addons whose inputs
+    changed are zipped again.
+
+    With ``reproducible`` set (the default), zips are written with sorted
+    entries and fixed timestamps and permissions, so identical inputs always
+    give byte-identical zips. How each file is compressed is decided by
+    ``policy`` (a CompressionPolicy).
+
+    addons.xml and a gzipped addons.xml.gz are streamed out together, with
+    the md5 of each (and, with ``sha256`` set, a sha256 sidecar) computed in
+    the same pass. The serialized ``<addon>``
+    entries are cached, so unchanged addons are spliced in as-is.
+
+    The cost of every stage is recorded in ``stats`` (a BuildStats, which can
+    be shared between releases); per-addon entries are keyed by
+    ``<release>/<folder>``.
+
+    With ``images`` (an ImageOptimizer), image assets are recompressed and
+    scaled down before they're published next to the zip.
+
+    Each zip gets ``.md5`` and ``.sha256`` sidecars, hashed from the bytes
+    as they're written rather than by reading the zip back, and
+    ``zips/checksums.sha256`` lists them all for ``sha256sum -c``.
+
+    With a ``store`` (an ArtifactStore), zips and meta files are kept by
+    content and linked into each release's zips folder, so an addon that is
+    identical in several releases is only built once.
+
+    The build runs on construction unless ``build`` is False. The generator
+    keeps the repository state in memory, so a long-running process can call
+    ``build(folders)`` again to rebuild just the folders that changed.
     """
 
-    def __init__(self, release):
+    def __init__(
+        self,
+        release,
+        executor=None,
+        reproducible=True,
+        sha256=False,
+        stats=None,
+        build=True,
+        policy=None,
+        store=None,
+        images=None,
+    ):
         self.release_path = release
+        self.store = store
+        self.images = images
+        self._executor = executor
+        self.stats = stats if stats is not None else BuildStats()
+        self.reproducible = reproducible
+        self.policy = policy if policy is not None else CompressionPolicy()
+        self.checksums = ("md5", "sha256") if sha256 else ("md5",)
         self.zips_path = os.path.join(self.release_path, "zips")
-        addons_xml_path = os.path.join(self.zips_path, "addons.xml")
-        md5_path = os.path.join(self.zips_path, "addons.xml.md5")
+        self.addons_xml_path = os.path.join(self.zips_path, "addons.xml")
+        self.manifest_path = os.path.join(
+            self.release_path, CACHE_DIR, "manifest.json"
+        )
+        self.fragments_path = os.path.join(
+            self.release_path, CACHE_DIR, "fragments.json"
+        )
 
         if not os.path.exists(self.zips_path):
             os.makedirs(self.zips_path)
 
-        self._remove_binaries()
+        self._index = None
+        self._addons_root = None
+        self._fragments = None
+        self._manifest = self._load_manifest()
 
-        if self._generate_addons_file(addons_xml_path):
-            print(
-                "Successfully updated {}".format(color_text(addons_xml_path, 'yellow'))
+        if build:
+            self.build()
+
+    def __getstate__(self):
+        # the executor can't be pickled, and workers only need the files of
+        # the addon they package, which are passed to them directly
+        state = self.__dict__.copy()
+        for name in (
+            "_executor",
+            "_index",
+            "_manifest",
+            "_addons_root",
+            "_fragments",
+            "stats",
+        ):
+            state.pop(name, None)
+        return state
+
+    def build(self, folders=None):
+        """
+        Runs the build. With ``folders``, only those top-level folders are
+        rescanned and considered for packaging; everything else is reused
+        from this generator's previous build. Returns True if addons.xml
+        was rewritten.
+        """
+        with self.stats.stage("discovery") as stage:
+            if folders is None or self._index is None:
+                self._index = self._build_index()
+                folders = None
+            else:
+                self._index.refresh(folders)
+            stage["files"] = sum(len(f) for f in self._index.folders.values())
+        with self.stats.stage("remove_binaries") as stage:
+            self._remove_binaries()
+            stage["files"] = len(self._index.compiled_files) + len(
+                self._index.compiled_dirs
             )
 
-            if self._generate_md5_file(addons_xml_path, md5_path):
-                print("Successfully updated {}".format(color_text(md5_path, 'yellow')))
+        return bool(self._generate_addons_file(self.addons_xml_path, folders))
+
+    def _build_index(self):
+        """
+        Indexes the release tree; every later stage reads from this index.
+        """
+        return TreeIndex(self.release_path, exclude=("zips",))
 
     def _remove_binaries(self):
         """
         Removes any and all compiled Python files before operations.
         """
 
-        for parent, dirnames, filenames in os.walk(self.release_path):
-            for fn in filenames:
-                if fn.lower().endswith("pyo") or fn.lower().endswith("pyc"):
-                    compiled = os.path.join(parent, fn)
-                    try:
-                        os.remove(compiled)
-                        print(
-                            "Removed compiled python file: {}".format(
-                                color_text(compiled, 'green')
-                            )
-                        )
-                    except:
-                        print(
-                            "Failed to remove compiled python file: {}".format(
-                                color_text(compiled, 'red')
-                            )
-                        )
-            for dir in dirnames:
-                if "pycache" in dir.lower():
-                    compiled = os.path.join(parent, dir)
-                    try:
-                        shutil.rmtree(compiled)
-                        print(
-                            "Removed __pycache__ cache folder: {}".format(
-                                color_text(compiled, 'green')
-                            )
-                        )
-                    except:
-                        print(
-                            "Failed to remove __pycache__ cache folder:  {}".format(
-                                color_text(compiled, 'red')
-                            )
-                        )
+        for compiled in self._index.compiled_files:
+            try:
+                os.remove(compiled)
+                print(
+                    "Removed compiled python file: {}".format(
+                        color_text(compiled, 'green')
+                    )
+                )
+            except:
+                print(
+                    "Failed to remove compiled python file: {}".format(
+                        color_text(compiled, 'red')
+                    )
+                )
+        for compiled in self._index.compiled_dirs:
+            try:
+                shutil.rmtree(compiled)
+                print(
+                    "Removed __pycache__ cache folder: {}".format(
+                        color_text(compiled, 'green')
+                    )
+                )
+            except:
+                print(
+                    "Failed to remove __pycache__ cache folder:  {}".format(
+                        color_text(compiled, 'red')
+                    )
+                )
+
+    def _load_manifest(self):
+        """
+        Loads the build manifest, or returns an empty one.
+        """
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest["addons"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _save_manifest(self):
+        """
+        Atomically writes the build manifest.
+        """
+        self._save_json(
+            {"version": MANIFEST_VERSION, "addons": self._manifest},
+            self.manifest_path,
+        )
+
+    def _save_json(self, data, path):
+        """
+        Atomically writes ``data`` as JSON into the build cache.
+        """
+        cache_dir = os.path.dirname(path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _addon_key(self, folder):
+        return "{}/{}".format(self.release_path, folder)
+
+    def _scan_addon(self, folder, state):
+        """
+        Returns (digest, files) describing the inputs of an addon folder.
 
-    def _create_zip(self, folder, addon_id, version):
+        Files whose size and mtime match the previous manifest ``state``
+        reuse its content hash, so an unchanged addon costs one stat per
+        file; anything else is hashed again.
         """
-        Creates a zip file in the zips directory for the given addon.
+        addon_folder = os.path.join(self.release_path, folder)
+        known = state["files"] if state else {}
+        files = {}
+        with self.stats.stage("scan", self._addon_key(folder)) as stage:
+            for relpath, st in self._index.folders[folder].items():
+                cached = known.get(relpath)
+                if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                    files[relpath] = cached
+                else:
+                    files[relpath] = [
+                        st.st_size,
+                        st.st_mtime_ns,
+                        hash_file(os.path.join(addon_folder, relpath)),
+                    ]
+                    stage["bytes_read"] += st.st_size
+            stage["files"] = len(files)
+
+        digest = hashlib.sha256()
+        for relpath in sorted(files):
+            digest.update(
+                "{}\0{}\0{}\n".format(relpath, files[relpath][0], files[relpath][2])
+                .encode("utf-8")
+            )
+        return digest.hexdigest(), files
+
+    def _zip_path(self, addon_id, version):
+        return os.path.join(
+            self.zips_path, addon_id, "{0}-{1}.zip".format(addon_id, version)
+        )
+
+    def _zip_key(self, archive_root, files, state):
+        """
+        Returns the store key of a reproducible zip: a hash of everything
+        that determines its bytes.
+        """
+        executables = sorted(
+            relpath for relpath, st in files.items() if st.st_mode & 0o111
+        )
+        # zips are streamed with data descriptors, so their bytes differ from
+        # the ones stored under the old "zip" keys
+        return hashlib.sha256(
+            json.dumps(
+                ["streamed-zip", archive_root, state["digest"], self.policy.key(), executables]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def _create_zip(self, folder, addon_id, version, files, state):
+        """
+        Creates a zip file in the zips directory for the given addon from
+        its indexed ``files``.
+        """
+        with self.stats.stage("create_zip", self._addon_key(folder)) as stage:
+            stage["files"] = len(files)
+            stage["bytes_read"] = sum(st.st_size for st in files.values())
+            stage["bytes_written"] = self._write_zip(
+                folder, addon_id, version, files, state
+            )
+
+    def _write_zip(self, folder, addon_id, version, files, state):
+        """
+        Writes the zip for ``_create_zip`` and its checksum sidecars, and
+        returns the number of bytes written to the zips directory.
         """
         addon_folder = os.path.join(self.release_path, folder)
         zip_folder = os.path.join(self.zips_path, addon_id)
         if not os.path.exists(zip_folder):
             os.makedirs(zip_folder)
 
-        final_zip = os.path.join(zip_folder, "{0}-{1}.zip".format(addon_id, version))
-        if not os.path.exists(final_zip):
-            zip = zipfile.ZipFile(final_zip, "w", compression=zipfile.ZIP_DEFLATED)
-            root_len = len(os.path.dirname(os.path.abspath(addon_folder)))
-
-            for root, dirs, files in os.walk(addon_folder):
-                # remove any unneeded artifacts
-                for i in IGNORE:
-                    if i in dirs:
-                        try:
-                            dirs.remove(i)
-                        except:
-                            pass
-                    for f in files:
-                        if f.startswith(i):
-                            try:
-                                files.remove(f)
-                            except:
-                                pass
-
-                archive_root = os.path.abspath(root)[root_len:]
-
-                for f in files:
-                    fullpath = os.path.join(root, f)
-                    archive_name = os.path.join(archive_root, f)
-                    zip.write(fullpath, archive_name, zipfile.ZIP_DEFLATED)
-
-            zip.close()
-            size = convert_bytes(os.path.getsize(final_zip))
-            print(
-                "Zip created for {} ({}) - {}".format(
-                    color_text(addon_id, 'cyan'),
-                    color_text(version, 'green'),
-                    color_text(size, 'yellow'),
+        final_zip = self._zip_path(addon_id, version)
+        archive_root = os.path.basename(os.path.abspath(addon_folder))
+
+        key = None
+        if self.reproducible and self.store is not None:
+            key = self._zip_key(archive_root, files, state)
+            if self.store.has(key):
+                self._write_zip_checksums(final_zip, self._stored_checksums(key))
+                if self.store.link(key, final_zip):
+                    print(
+                        "Zip linked for {} ({}) from the artifact store".format(
+                            color_text(addon_id, 'cyan'), color_text(version, 'green')
+                        )
+                    )
+                else:
+                    print(
+                        "Zip unchanged for {} ({})".format(
+                            color_text(addon_id, 'cyan'), color_text(version, 'green')
+                        )
+                    )
+                return 0
+
+        if not self.reproducible:
+            # final_zip may be a link into the store, shared with other
+            # releases, so it's replaced rather than written through
+            tmp_zip = final_zip + ".tmp"
+            with open(tmp_zip, "wb") as f:
+                out = HashingWriter(f, ZIP_CHECKSUMS)
+                zip = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED)
+                for relpath in files:
+                    fullpath = os.path.join(addon_folder, relpath)
+                    archive_name = "{}/{}".format(archive_root, relpath)
+                    size = files[relpath].st_size
+                    compress_type, level = self.policy.choose(relpath, size)
+                    with self.stats.stage("compress", file_type=file_type(relpath)) as stage:
+                        zip.write(fullpath, archive_name, compress_type, level)
+                        stage.update(files=1, bytes_read=size)
+                        stage["bytes_written"] = zip.infolist()[-1].compress_size
+                zip.close()
+            os.replace(tmp_zip, final_zip)
+            checksums = out.hexdigests()
+        else:
+            tmp_zip = final_zip + ".tmp"
+            checksums = self._write_reproducible_zip(folder, archive_root, files, tmp_zip)
+            if key is not None:
+                self.store.put(key, tmp_zip, move=True)
+                self.store.put_checksums(key, checksums)
+                self.store.link(key, final_zip)
+            elif self._current_checksum(final_zip) == checksums["sha256"]:
+                # leave the existing file alone so its mtime, and every
+                # cache keyed on it, stays valid
+                os.remove(tmp_zip)
+                self._write_zip_checksums(final_zip, checksums)
+                print(
+                    "Zip unchanged for {} ({})".format(
+                        color_text(addon_id, 'cyan'), color_text(version, 'green')
+                    )
                 )
+                return 0
+            else:
+                os.replace(tmp_zip, final_zip)
+        self._write_zip_checksums(final_zip, checksums)
+
+        size = os.path.getsize(final_zip)
+        print(
+            "Zip created for {} ({}) - {}".format(
+                color_text(addon_id, 'cyan'),
+                color_text(version, 'green'),
+                color_text(convert_bytes(size), 'yellow'),
             )
+        )
+        return size
+
+    def _write_reproducible_zip(self, folder, archive_root, files, zip_path):
+        """
+        Writes the addon's ``files`` to ``zip_path`` so that the same inputs
+        always produce the same bytes, and returns the zip's checksums,
+        computed as it was written.
+        """
+        addon_folder = os.path.join(self.release_path, folder)
+        with open(zip_path, "wb") as f:
+            out = HashingWriter(f, ZIP_CHECKSUMS)
+            with zipfile.ZipFile(out, "w") as zip:
+                for relpath in sorted(files):
+                    fullpath = os.path.join(addon_folder, relpath)
+                    archive_name = "{}/{}".format(archive_root, relpath)
+                    st = files[relpath]
+                    mode = 0o755 if st.st_mode & 0o111 else 0o644
+                    info = zipfile.ZipInfo(archive_name, date_time=ZIP_TIMESTAMP)
+                    info.create_system = 3
+                    info.external_attr = (0o100000 | mode) << 16
+                    set_compression(info, *self.policy.choose(relpath, st.st_size))
+                    info.file_size = st.st_size
+                    with self.stats.stage("compress", file_type=file_type(relpath)) as stage:
+                        with open(fullpath, "rb") as src, zip.open(info, "w") as dest:
+                            shutil.copyfileobj(src, dest, 1024 * 1024)
+                        stage.update(files=1, bytes_read=st.st_size)
+                        stage["bytes_written"] = info.compress_size
+        return out.hexdigests()
+
+    def _stored_checksums(self, key):
+        """
+        Returns the checksums of the stored zip ``key``, hashing it once if
+        they weren't recorded when it was stored.
+        """
+        checksums = self.store.checksums(key)
+        if checksums is None:
+            path = self.store.path(key)
+            checksums = {name: hash_file(path, name) for name in ZIP_CHECKSUMS}
+            self.store.put_checksums(key, checksums)
+        return checksums
+
+    def _current_checksum(self, zip_path):
+        """
+        Returns the sha256 of the zip at ``zip_path`` from its sidecar when
+        that is at least as new as the zip, by hashing it otherwise, or None
+        if there is no zip.
+        """
+        if not os.path.exists(zip_path):
+            return None
+        sidecar = zip_path + ".sha256"
+        try:
+            if os.path.getmtime(sidecar) >= os.path.getmtime(zip_path):
+                with open(sidecar, "r") as f:
+                    return f.read().strip()
+        except OSError:
+            pass
+        return hash_file(zip_path)
+
+    def _write_zip_checksums(self, zip_path, checksums):
+        """
+        Writes a ``<zip>.<algorithm>`` sidecar for each of ``checksums``,
+        leaving the ones that are already current untouched.
+        """
+        for name in ZIP_CHECKSUMS:
+            sidecar = "{}.{}".format(zip_path, name)
+            try:
+                with open(sidecar, "r") as f:
+                    if f.read() == checksums[name]:
+                        continue
+            except OSError:
+                pass
+            self._save_file(checksums[name], file=sidecar)
 
-    def _copy_meta_files(self, addon_id, addon_folder):
+    def _write_checksums_manifest(self):
+        """
+        Writes ``zips/checksums.sha256``, listing the sha256 of every zip in
+        the release in ``sha256sum`` format, from the zips' sidecars.
+        """
+        entries = []
+        for id, state in self._manifest.items():
+            zip_path = self._zip_path(id, state["version"])
+            try:
+                with open(zip_path + ".sha256", "r") as f:
+                    checksum = f.read().strip()
+            except OSError:
+                continue
+            relpath = os.path.relpath(zip_path, self.zips_path).replace(os.sep, "/")
+            entries.append((relpath, checksum))
+        data = "".join(
+            "{}  {}\n".format(checksum, relpath) for relpath, checksum in sorted(entries)
+        )
+        path = os.path.join(self.zips_path, CHECKSUMS_MANIFEST)
+        try:
+            with open(path, "r") as f:
+                if f.read() == data:
+                    return
+        except OSError:
+            pass
+        self._save_file(data, file=path)
+        print("Successfully updated {}".format(color_text(path, 'yellow')))
+
+    def _copy_meta_files(self, addon_id, addon_folder, files, state):
         """
         Copy the addon.xml and relevant art files into the relevant folders in the repository.
         """
@@ -251,74 +1186,201 @@ class Generator:
         root = tree.getroot()
 
         copyfiles = ["addon.xml"]
+        tags = {}
         for ext in root.findall("extension"):
             if ext.get("point") in ["xbmc.addon.metadata", "kodi.addon.metadata"]:
                 assets = ext.find("assets")
                 if not assets:
                     continue
                 for art in [a for a in assets if a.text]:
-                    copyfiles.append(os.path.normpath(art.text))
+                    copyfiles.append(
+                        os.path.normpath(art.text).replace(os.sep, "/")
+                    )
+                    tags[copyfiles[-1]] = art.tag
 
         src_folder = os.path.join(self.release_path, addon_id)
-        for file in copyfiles:
-            addon_path = os.path.join(src_folder, file)
-            if not os.path.exists(addon_path):
-                continue
+        with self.stats.stage("copy_meta_files", self._addon_key(addon_id)) as stage:
+            for file in copyfiles:
+                if file not in files:
+                    continue
+                addon_path = os.path.join(src_folder, file)
 
-            zips_path = os.path.join(addon_folder, file)
-            asset_path = os.path.split(zips_path)[0]
-            if not os.path.exists(asset_path):
-                os.makedirs(asset_path)
+                zips_path = os.path.join(addon_folder, file)
+                asset_path = os.path.split(zips_path)[0]
+                if not os.path.exists(asset_path):
+                    os.makedirs(asset_path)
 
-            shutil.copy(addon_path, zips_path)
+                stage["files"] += 1
+                stage["bytes_read"] += files[file].st_size
+                if (
+                    self.images is not None
+                    and self.images.available()
+                    and file_type(file) in IMAGE_EXTENSIONS
+                ):
+                    with self.stats.stage(
+                        "optimize_images", self._addon_key(addon_id)
+                    ) as image_stage:
+                        image_stage.update(files=1, bytes_read=files[file].st_size)
+                        written = self.images.optimize(
+                            addon_path, state["files"][file][2], tags.get(file), zips_path
+                        )
+                        image_stage["bytes_written"] = written
+                    stage["bytes_written"] += written
+                    continue
+
+                if self.store is not None:
+                    key = state["files"][file][2]
+                    self.store.put(key, addon_path)
+                    self.store.link(key, zips_path)
+                else:
+                    link_or_copy(addon_path, zips_path, link=False)
+                stage["bytes_written"] += files[file].st_size
 
-    def _generate_addons_file(self, addons_xml_path):
+    def _package_addon(self, folder, addon_id, version, files, state):
+        """
+        Creates the zip and copies the meta files for a single addon, and
+        returns the BuildStats recorded while doing so.
+        """
+        # record into fresh stats so a worker process can send them back
+        stats = getattr(self, "stats", None)
+        self.stats = BuildStats()
+        try:
+            self._create_zip(folder, addon_id, version, files, state)
+            self._copy_meta_files(
+                folder, os.path.join(self.zips_path, addon_id), files, state
+            )
+            return self.stats
+        finally:
+            self.stats = stats
+
+    def _package_addons(self, packages):
+        """
+        Packages each (folder, addon_id, version, files, state) in
+        ``packages``, using the executor when one was given. Returns the
+        addon ids that failed.
+        """
+        if self._executor is None:
+            results = []
+            for package in packages:
+                try:
+                    results.append((self._package_addon(*package), None))
+                except Exception as e:
+                    results.append((None, e))
+        else:
+            futures = [
+                self._executor.submit(self._package_addon, *package)
+                for package in packages
+            ]
+            results = []
+            for future in futures:
+                error = future.exception()
+                results.append((None, error) if error else (future.result(), None))
+
+        failed = set()
+        for (folder, addon_id, _, _, _), (stats, error) in zip(packages, results):
+            if stats is not None:
+                self.stats.merge(stats)
+            if error is not None:
+                failed.add(addon_id)
+                print(
+                    "Excluding {}: {}".format(
+                        color_text(folder, 'yellow'), color_text(error, 'red')
+                    )
+                )
+        return failed
+
+    def _generate_addons_file(self, addons_xml_path, folders=None):
         """
         Generates a zip for each found addon, and updates the addons.xml file accordingly.
+        With ``folders``, only those addon folders are considered.
         """
-        if not os.path.exists(addons_xml_path):
+        if self._addons_root is not None:
+            addons_root = self._addons_root
+        elif not os.path.exists(addons_xml_path):
             addons_root = ElementTree.Element('addons')
-            addons_xml = ElementTree.ElementTree(addons_root)
         else:
-            addons_xml = ElementTree.parse(addons_xml_path)
-            addons_root = addons_xml.getroot()
+            addons_root = ElementTree.parse(addons_xml_path).getroot()
+        self._addons_root = addons_root
 
         folders = [
-            i
-            for i in os.listdir(self.release_path)
-            if os.path.isdir(os.path.join(self.release_path, i))
-            and i != "zips"
-            and not i.startswith(".")
-            and os.path.exists(os.path.join(self.release_path, i, "addon.xml"))
+            folder
+            for folder in self._index.addons()
+            if folders is None or folder in folders
         ]
 
-        addon_xpath = "addon[@id='{}']"
+        # index the existing entries once, so every lookup below is O(1)
+        entries = list(addons_root)
+        positions = {entry.get('id'): i for i, entry in enumerate(entries)}
         changed = False
+        packages = []
+        scanned = {}
+        fresh = set()
+        known_folders = {
+            state["folder"]: id for id, state in self._manifest.items()
+        }
+        images_key = self.images.key() if self.images is not None else None
         for addon in folders:
             try:
                 addon_xml_path = os.path.join(self.release_path, addon, "addon.xml")
-                addon_xml = ElementTree.parse(addon_xml_path)
-                addon_root = addon_xml.getroot()
-                id = addon_root.get('id')
-                version = addon_root.get('version')
-
-                updated = False
-                addon_entry = addons_root.find(addon_xpath.format(id))
-                if addon_entry is not None and addon_entry.get('version') != version:
-                    index = addons_root.findall('addon').index(addon_entry)
-                    addons_root.remove(addon_entry)
-                    addons_root.insert(index, addon_root)
-                    updated = True
+                id = known_folders.get(addon)
+                state = self._manifest.get(id)
+                digest, files = self._scan_addon(addon, state)
+
+                # an addon.xml that hasn't changed needn't be parsed again
+                addon_root = None
+                previous = state["files"].get("addon.xml") if state else None
+                current = files.get("addon.xml")
+                if previous and current and previous[2] == current[2]:
+                    version = state["version"]
+                else:
+                    addon_root = ElementTree.parse(addon_xml_path).getroot()
+                    id = addon_root.get('id')
+                    version = addon_root.get('version')
+                    state = self._manifest.get(id)
+
+                stale = (
+                    state is None
+                    or state["version"] != version
+                    or state["digest"] != digest
+                    or state.get("policy") != self.policy.key()
+                    or state.get("images") != images_key
+                    or not os.path.exists(self._zip_path(id, version))
+                    or not os.path.exists(self._zip_path(id, version) + ".sha256")
+                )
+                if state and state["version"] == version and state["digest"] != digest:
+                    print(
+                        "{} changed without a version bump ({})".format(
+                            color_text(id, 'cyan'), color_text(version, 'red')
+                        )
+                    )
+
+                position = positions.get(id)
+                addon_entry = entries[position] if position is not None else None
+                if addon_entry is None or addon_entry.get('version') != version:
+                    if addon_root is None:
+                        addon_root = ElementTree.parse(addon_xml_path).getroot()
+                if addon_entry is not None and addon_root is not None:
+                    entries[position] = addon_root
+                    fresh.add(id)
                     changed = True
                 elif addon_entry is None:
-                    addons_root.append(addon_root)
-                    updated = True
+                    positions[id] = len(entries)
+                    entries.append(addon_root)
+                    fresh.add(id)
                     changed = True
 
-                if updated:
-                    # Create the zip files
-                    self._create_zip(addon, id, version)
-                    self._copy_meta_files(addon, os.path.join(self.zips_path, id))
+                scanned[id] = {
+                    "folder": addon,
+                    "version": version,
+                    "digest": digest,
+                    "policy": self.policy.key(),
+                    "images": images_key,
+                    "files": files,
+                }
+                if stale:
+                    packages.append(
+                        (addon, id, version, self._index.folders[addon], scanned[id])
+                    )
             except Exception as e:
                 print(
                     "Excluding {}: {}".format(
@@ -326,13 +1388,26 @@ class Generator:
                     )
                 )
 
+        # Create the zip files
+        failed = self._package_addons(packages)
+        manifest_changed = False
+        for id, state in scanned.items():
+            if id in failed:
+                self._manifest.pop(id, None)
+                manifest_changed = True
+            elif self._manifest.get(id) != state:
+                self._manifest[id] = state
+                manifest_changed = True
+        if manifest_changed:
+            self._save_manifest()
+        self._write_checksums_manifest()
+
+        if not os.path.exists(addons_xml_path + ".gz"):
+            changed = True
         if changed:
-            addons_root[:] = sorted(addons_root, key=lambda addon: addon.get('id'))
+            addons_root[:] = sorted(entries, key=lambda addon: addon.get('id'))
             try:
-                addons_xml.write(
-                    addons_xml_path, encoding="utf-8", xml_declaration=True
-                )
-
+                self._write_addons_file(addons_root, addons_xml_path, fresh)
                 return changed
             except Exception as e:
                 print(
@@ -341,23 +1416,75 @@ class Generator:
                     )
                 )
 
-    def _generate_md5_file(self, addons_xml_path, md5_path):
+    def _load_fragments(self):
         """
-        Generates a new addons.xml.md5 file.
+        Loads the cache of serialized <addon> entries.
         """
+        if self._fragments is not None:
+            return self._fragments
         try:
-            with open(addons_xml_path, "r", encoding="utf-8") as f:
-                m = hashlib.md5(f.read().encode("utf-8")).hexdigest()
-                self._save_file(m, file=md5_path)
+            with open(self.fragments_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
 
-            return True
-        except Exception as e:
-            print(
-                "An error occurred updating {}!\n{}".format(
-                    color_text(md5_path, 'yellow'), color_text(e, 'red')
-                )
+    def _write_addons_file(self, addons_root, addons_xml_path, fresh):
+        """
+        Streams addons.xml to disk and writes its checksum files from the
+        same pass. Entries not in ``fresh`` are taken from the fragment cache
+        when their version still matches.
+        """
+        cached = self._load_fragments()
+        fragments = {}
+
+        gz_path = addons_xml_path + ".gz"
+        tmp_path = addons_xml_path + ".tmp"
+        tmp_gz_path = gz_path + ".tmp"
+        with self.stats.stage("addons_xml") as stage, open(
+            tmp_path, "wb"
+        ) as f, open(tmp_gz_path, "wb") as gz_f:
+            xml_out = HashingWriter(f, self.checksums)
+            gz_out = HashingWriter(gz_f, self.checksums)
+            # no name or mtime in the header, so the .gz is reproducible
+            gz = gzip.GzipFile(
+                filename="", mode="wb", compresslevel=9, fileobj=gz_out, mtime=0
             )
 
+            def write(data):
+                xml_out.write(data)
+                gz.write(data)
+
+            write(b"<?xml version='1.0' encoding='utf-8'?>\n<addons>")
+            for addon in addons_root:
+                id = addon.get('id')
+                version = addon.get('version')
+                fragment = cached.get(id)
+                if id in fresh or not fragment or fragment["version"] != version:
+                    fragment = {
+                        "version": version,
+                        "xml": ElementTree.tostring(addon, encoding="unicode"),
+                    }
+                fragments[id] = fragment
+                data = fragment["xml"].encode("utf-8")
+                write(data)
+                stage["files"] += 1
+                stage["bytes_written"] += len(data)
+            write(b"</addons>")
+            gz.close()
+            stage["bytes_written"] += gz_f.tell()
+        os.replace(tmp_path, addons_xml_path)
+        os.replace(tmp_gz_path, gz_path)
+
+        for path, out in ((addons_xml_path, xml_out), (gz_path, gz_out)):
+            print("Successfully updated {}".format(color_text(path, 'yellow')))
+            for algorithm in self.checksums:
+                checksum_path = "{}.{}".format(path, algorithm)
+                self._save_file(out.hexdigest(algorithm), file=checksum_path)
+                print("Successfully updated {}".format(color_text(checksum_path, 'yellow')))
+
+        self._save_json(fragments, self.fragments_path)
+        self._fragments = fragments
+
     def _save_file(self, data, file):
         """
         Saves a file.
@@ -373,6 +1500,162 @@ class Generator:
             )
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Zip up every addon and regenerate addons.xml for each release."
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of packaging processes (0 uses every CPU, default: 1)",
+    )
+    parser.add_argument(
+        "--no-reproducible",
+        dest="reproducible",
+        action="store_false",
+        help="zip with filesystem timestamps and walk order",
+    )
+    parser.add_argument(
+        "--compresslevel",
+        type=int,
+        default=ZIP_COMPRESSLEVEL,
+        help="default deflate level, 0 stores (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--level",
+        action="append",
+        default=[],
+        metavar="EXT=LEVEL",
+        help="deflate level for one extension, e.g. .py=9 (repeatable)",
+    )
+    parser.add_argument(
+        "--size-level",
+        action="append",
+        default=[],
+        metavar="MAX_KB=LEVEL",
+        help="deflate level for files up to MAX_KB in size (repeatable)",
+    )
+    parser.add_argument(
+        "--store",
+        action="append",
+        default=[],
+        metavar="EXT",
+        help="also store files with this extension uncompressed (repeatable)",
+    )
+    parser.add_argument(
+        "--no-store",
+        dest="artifact_store",
+        action="store_false",
+        help="don't share zips and meta files between releases through the "
+        "artifact store",
+    )
+    parser.add_argument(
+        "--optimize-images",
+        action="store_true",
+        help="recompress and scale down the artwork published next to each "
+        "zip (needs Pillow)",
+    )
+    parser.add_argument(
+        "--image-quality",
+        type=int,
+        default=85,
+        help="JPEG quality for --optimize-images (default: 85)",
+    )
+    parser.add_argument(
+        "--image-variant",
+        action="append",
+        type=int,
+        default=[],
+        metavar="WIDTH",
+        help="with --optimize-images, also publish each image capped at "
+        "WIDTH pixels (repeatable)",
+    )
+    parser.add_argument(
+        "--sha256",
+        action="store_true",
+        help="also write an addons.xml.sha256 checksum",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="write per-stage and per-addon build costs to a JSON file",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="write a cProfile dump of the main process",
+    )
+    parser.add_argument(
+        "--timings", action="store_true", help="print a per-stage summary"
+    )
+    args = parser.parse_args(argv)
+
+    releases = [r for r in KODI_VERSIONS if os.path.exists(r)]
+    workers = args.workers or os.cpu_count()
+    stats = BuildStats()
+    levels = dict(
+        (ext, int(level)) for ext, level in (item.split("=", 1) for item in args.level)
+    )
+    size_levels = [
+        (int(max_kb) * 1024, int(level))
+        for max_kb, level in (item.split("=", 1) for item in args.size_level)
+    ]
+    store = ArtifactStore(os.path.join(CACHE_DIR, "store")) if args.artifact_store else None
+    images = None
+    if args.optimize_images:
+        if ImageOptimizer.available():
+            images = ImageOptimizer(
+                ArtifactStore(os.path.join(CACHE_DIR, "images")),
+                quality=args.image_quality,
+                variants=args.image_variant,
+            )
+        else:
+            print(color_text("Pillow isn't installed, images are copied as-is", 'yellow'))
+    policy = CompressionPolicy(
+        level=args.compresslevel,
+        levels=levels,
+        stored=STORED_EXTENSIONS + args.store,
+        size_levels=size_levels,
+    )
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        with contextlib.ExitStack() as stack:
+            executor = None
+            if workers > 1:
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            for release in releases:
+                Generator(
+                    release,
+                    executor=executor,
+                    reproducible=args.reproducible,
+                    sha256=args.sha256,
+                    stats=stats,
+                    policy=policy,
+                    store=store,
+                    images=images,
+                )
+        # drop the objects of zips and images no release publishes any more
+        zips_folders = [os.path.join(release, "zips") for release in releases]
+        for cache in (store, images.cache if images is not None else None):
+            if cache is not None:
+                removed = cache.prune(zips_folders)
+                if removed:
+                    print("Pruned {} unused objects from {}".format(
+                        removed, color_text(cache.root, 'yellow')))
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    if args.timings:
+        stats.print_summary()
+    if args.report:
+        stats.write(args.report)
+
+
 if __name__ == "__main__":
-    for release in [r for r in KODI_VERSIONS if os.path.exists(r)]:
-        Generator(release)
+    main()
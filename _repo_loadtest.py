@@ -0,0 +1,212 @@
+"""
+    Load-tests a repository server with a storm of simulated Kodi clients.
+
+    Each client keeps one connection open and repeatedly does what Kodi does
+    on a repository refresh: fetch the index checksum, revalidate the index
+    with its ETag, and now and then download (or resume, with a Range
+    request) an addon zip. By default an in-process _repo_server is started
+    on localhost, so the whole test runs on one machine.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from _repo_generator import color_text, convert_bytes
+from _repo_server import RepoServer
+
+
+def find_targets(root):
+    """
+    Returns the (index paths, zip paths) under ``root`` as URL paths.
+    """
+    indexes, zips = [], []
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for f in sorted(files):
+            url = "/" + os.path.relpath(os.path.join(folder, f), root).replace(os.sep, "/")
+            if f == "addons.xml":
+                indexes.append(url)
+            elif f.endswith(".zip"):
+                zips.append(url)
+    return indexes, zips
+
+
+class Client(threading.Thread):
+    """
+    One simulated Kodi box, recording a (seconds, status, bytes) sample per
+    request.
+    """
+
+    def __init__(self, host, port, indexes, zips, refreshes, zip_ratio, seed):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.indexes = indexes
+        self.zips = zips
+        self.refreshes = refreshes
+        self.zip_ratio = zip_ratio
+        self.rng = random.Random(seed)
+        self.etags = {}
+        self.samples = []
+        self.errors = 0
+
+    def _request(self, conn, path, headers):
+        start = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        self.samples.append((time.perf_counter() - start, response.status, len(body)))
+        return response
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        for _ in range(self.refreshes):
+            try:
+                for index in self.indexes:
+                    self._request(conn, index + ".md5", {})
+                    headers = {"Accept-Encoding": "gzip"}
+                    if index in self.etags:
+                        headers["If-None-Match"] = self.etags[index]
+                    response = self._request(conn, index, headers)
+                    if response.getheader("ETag"):
+                        self.etags[index] = response.getheader("ETag")
+                if self.zips and self.rng.random() < self.zip_ratio:
+                    headers = {}
+                    if self.rng.random() < 0.5:
+                        headers["Range"] = "bytes={}-".format(self.rng.randint(0, 4096))
+                    self._request(conn, self.rng.choice(self.zips), headers)
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        conn.close()
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def load_test(host, port, indexes, zips, clients=50, refreshes=20, zip_ratio=0.1, seed=0):
+    """
+    Runs ``clients`` concurrent clients against the server and returns the
+    throughput and latency figures.
+    """
+    workers = [
+        Client(host, port, indexes, zips, refreshes, zip_ratio, seed + i)
+        for i in range(clients)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    total = time.perf_counter() - start
+
+    samples = [sample for worker in workers for sample in worker.samples]
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    transferred = sum(size for _, _, size in samples)
+    return {
+        "clients": clients,
+        "requests": len(samples),
+        "errors": sum(worker.errors for worker in workers),
+        "seconds": total,
+        "requests_per_s": len(samples) / total if total else None,
+        "bytes": transferred,
+        "mb_per_s": transferred / (1024 * 1024) / total if total else None,
+        "p50_ms": _percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": _percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": _percentile(latencies, 0.99) * 1000 if latencies else None,
+        "statuses": statuses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load-test the repository server with simulated Kodi clients."
+    )
+    parser.add_argument(
+        "root",
+        nargs="?",
+        default=".",
+        help="served folder, used to find the indexes and zips to request",
+    )
+    parser.add_argument(
+        "--url",
+        help="test an already running server instead of starting one on localhost",
+    )
+    parser.add_argument("-c", "--clients", type=int, default=50)
+    parser.add_argument(
+        "-n", "--refreshes", type=int, default=20, help="repository refreshes per client"
+    )
+    parser.add_argument(
+        "--zip-ratio",
+        type=float,
+        default=0.1,
+        help="fraction of refreshes that also download a zip",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    indexes, zips = find_targets(args.root)
+    if not indexes:
+        parser.error("no addons.xml found under {}".format(args.root))
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+        prefix = url.path.rstrip("/")
+        indexes = [prefix + path for path in indexes]
+        zips = [prefix + path for path in zips]
+    else:
+        server = RepoServer(("127.0.0.1", 0), args.root)
+        host, port = server.server_address[:2]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        results = load_test(
+            host, port, indexes, zips, args.clients, args.refreshes, args.zip_ratio, args.seed
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print(
+        "{} requests from {} clients in {:.2f}s: {} req/s, {}/s".format(
+            results["requests"],
+            results["clients"],
+            results["seconds"],
+            color_text("{:.0f}".format(results["requests_per_s"] or 0), 'cyan'),
+            convert_bytes((results["mb_per_s"] or 0) * 1024 * 1024),
+        )
+    )
+    print(
+        "latency p50 {:.2f}ms, p95 {:.2f}ms, p99 {:.2f}ms".format(
+            results["p50_ms"] or 0, results["p95_ms"] or 0, results["p99_ms"] or 0
+        )
+    )
+    print(
+        "statuses: {}, errors: {}".format(
+            ", ".join("{} x{}".format(k, v) for k, v in sorted(results["statuses"].items())),
+            color_text(results["errors"], 'red' if results["errors"] else 'green'),
+        )
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
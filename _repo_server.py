@@ -0,0 +1,275 @@
+"""
+    Serves the generated repository over HTTP, e.g. as a LAN mirror for
+    Kodi boxes.
+
+    Requests are handled on a thread pool with keep-alive connections.
+    Responses carry an ETag and Last-Modified so refreshing clients get a
+    cheap 304, single byte ranges are honoured, a precompressed ``.gz``
+    sibling (such as addons.xml.gz) is sent to clients that accept gzip,
+    and file bodies go out through socket.sendfile, which uses the kernel's
+    zero-copy sendfile where available.
+"""
+
+import argparse
+import email.utils
+import mimetypes
+import os
+import posixpath
+import threading
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from _repo_generator import color_text
+
+CONTENT_TYPES = {
+    ".xml": "text/xml; charset=utf-8",
+    ".md5": "text/plain; charset=utf-8",
+    ".sha256": "text/plain; charset=utf-8",
+    ".zip": "application/zip",
+    ".gz": "application/gzip",
+}
+
+
+class FileInfo:
+    """
+    The metadata a response needs for one file, cached by RepoServer until
+    the file's size or mtime changes.
+    """
+
+    def __init__(self, path, st):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.etag = '"{:x}-{:x}"'.format(st.st_mtime_ns, st.st_size)
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        ext = os.path.splitext(path)[1].lower()
+        self.content_type = (
+            CONTENT_TYPES.get(ext)
+            or mimetypes.guess_type(path)[0]
+            or "application/octet-stream"
+        )
+
+
+class RepoServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server for the files under ``root``. Hidden files and
+    folders (.git, .build_cache, ...) are never served.
+    """
+
+    daemon_threads = True
+    # room for a refresh storm of clients connecting at once
+    request_queue_size = 256
+
+    def __init__(self, address, root, verbose=False):
+        self.root = os.path.realpath(root)
+        self.verbose = verbose
+        self._files = {}
+        self._lock = threading.Lock()
+        super().__init__(address, RepoRequestHandler)
+
+    def lookup(self, path):
+        """
+        Returns the FileInfo for a file, or None if it isn't a regular file.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        info = self._files.get(path)
+        if info is None or info.size != st.st_size or info.mtime_ns != st.st_mtime_ns:
+            info = FileInfo(path, st)
+            with self._lock:
+                self._files[path] = info
+        return info
+
+
+class RepoRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RepoServer/1.0"
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _translate(self):
+        """
+        Maps the request path onto a file under the server root, or returns
+        None for paths that must not be served.
+        """
+        path = posixpath.normpath(unquote(urlsplit(self.path).path))
+        parts = [p for p in path.split("/") if p]
+        if any(p.startswith(".") for p in parts):
+            return None
+        full = os.path.realpath(os.path.join(self.server.root, *parts))
+        if full != self.server.root and not full.startswith(self.server.root + os.sep):
+            return None
+        if os.path.isdir(full):
+            full = os.path.join(full, "index.html")
+        return full
+
+    def _send_error(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _not_modified(self, etag, info):
+        """
+        Evaluates If-None-Match and, failing that, If-Modified-Since.
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or "W/" + etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(info.mtime_ns // 1_000_000_000) <= since.timestamp()
+        return False
+
+    def _byte_range(self, info):
+        """
+        Returns (start, end) for a satisfiable single Range header, False for
+        an unsatisfiable one and None when the whole file should be sent.
+        """
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes=") or "," in header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range not in (info.etag, info.last_modified):
+            return None
+        first, _, last = header[len("bytes="):].strip().partition("-")
+        try:
+            if not first:
+                length = int(last)
+                if length <= 0:
+                    return False
+                start, end = max(info.size - length, 0), info.size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else info.size - 1
+        except ValueError:
+            return None
+        if start >= info.size or start > end:
+            return False
+        return start, min(end, info.size - 1)
+
+    def _serve(self, send_body):
+        path = self._translate()
+        info = self.server.lookup(path) if path else None
+        if info is None:
+            self._send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        content_type = info.content_type
+        etag = info.etag
+        encoding = None
+        # ranges always refer to the plain file, so they're served from it
+        if (
+            not path.endswith(".gz")
+            and "Range" not in self.headers
+            and "gzip" in self.headers.get("Accept-Encoding", "")
+        ):
+            gz_info = self.server.lookup(path + ".gz")
+            if gz_info is not None:
+                encoding, info = "gzip", gz_info
+                etag = gz_info.etag[:-1] + '-gz"'
+
+        common = [
+            ("ETag", etag),
+            ("Last-Modified", info.last_modified),
+            ("Vary", "Accept-Encoding"),
+            ("Accept-Ranges", "bytes"),
+        ]
+        if self._not_modified(etag, info):
+            # a 304 never has a body, and a Content-Length on it would stand
+            # for the full representation, so none is sent
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for name, value in common:
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        byte_range = self._byte_range(info) if encoding is None else None
+        if byte_range is False:
+            self._send_error(
+                HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                [("Content-Range", "bytes */{}".format(info.size))],
+            )
+            return
+
+        try:
+            f = open(info.path, "rb")
+        except OSError:
+            self._send_error(HTTPStatus.NOT_FOUND)
+            return
+        with f:
+            if byte_range is None:
+                start, count = 0, info.size
+                self.send_response(HTTPStatus.OK)
+            else:
+                start, count = byte_range[0], byte_range[1] - byte_range[0] + 1
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header(
+                    "Content-Range",
+                    "bytes {}-{}/{}".format(byte_range[0], byte_range[1], info.size),
+                )
+            for name, value in common:
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(count))
+            self.end_headers()
+            if send_body and count:
+                self.wfile.flush()
+                self.connection.sendfile(f, start, count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the generated repository over HTTP."
+    )
+    parser.add_argument(
+        "root",
+        nargs="?",
+        default=".",
+        help="folder to serve (default: the current folder)",
+    )
+    parser.add_argument("--bind", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000)
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = RepoServer((args.bind, args.port), args.root, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    print(
+        "Serving {} on {}".format(
+            color_text(server.root, 'yellow'),
+            color_text("http://{}:{}/".format(host, port), 'cyan'),
+        )
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
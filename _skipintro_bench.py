@@ -0,0 +1,587 @@
+"""
+    Runs the Skip Intro service headless against a fake Kodi runtime and
+    benchmarks it.
+
+    The fake xbmc, xbmcgui, xbmcaddon and xbmcvfs modules are installed
+    before the addon's default.py is imported, so the real SkipIntroPlayer,
+    SkipIntroDialog and PlaybackScheduler run unchanged. Time is simulated:
+    the player's clock and the scheduler's waits follow a virtual clock, so
+    ten minutes of playback take milliseconds and every run is
+    deterministic. Scripted sessions cover chapter layouts, the default-skip
+    fallback, learned markers, seeks, pauses, speed changes and button
+    presses.
+
+    For each session it reports how late the prompt came, how far the skip
+    landed from its target, Kodi API calls per minute, scheduler wake-ups
+    and the service's CPU time per hour of playback. ``--poll`` replaces the
+    scheduler's waits with a fixed polling interval, for comparison with a
+    polling loop. Exits non-zero if a session misbehaves, so it can run in
+    CI.
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+ADDON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repo", "repository.skipintro")
+
+from _repo_generator import color_text  # noqa: E402
+
+DEFAULT_SETTINGS = {
+    "skip_by_default": False,
+    "show_countdown": True,
+    "skip_to_chapter": 2,
+    "seconds_before_skip": 5,
+    "use_default_skip_fallback": True,
+    "default_delay": 60,
+    "skip_duration": 30,
+    "chapter_diff_threshold": 15,
+    "dialog_display_duration": 5,
+    "prescan_library": False,
+}
+
+EPISODE = 2700.0
+# seconds of slack allowed on prompt latency and skip targets
+TOLERANCE = 0.5
+
+# Each session plays one episode for ``length`` seconds of wall time.
+# ``events`` are (wall time, action, argument); ``prompt`` and ``skip`` are
+# the playback positions where the dialog should appear and where the skip
+# should land, or None if there should be none.
+SESSIONS = [
+    {
+        "name": "chapters_press",
+        "chapters": [0, 70, 130, 900, 1800],
+        "events": [(72, "press", None)],
+        "prompt": 70,
+        "skip": 70,
+    },
+    {
+        "name": "chapters_short_second",
+        "chapters": [0, 60, 70, 900, 1800],
+        "events": [(62, "press", None)],
+        "prompt": 60,
+        "skip": 70,
+    },
+    {
+        "name": "chapters_ignored",
+        "chapters": [0, 70, 130, 900, 1800],
+        "events": [],
+        "prompt": 70,
+        "skip": None,
+    },
+    {
+        "name": "reprompt_after_seek_back",
+        "chapters": [0, 70, 130, 900, 1800],
+        "events": [(140, "seek", 65), (147, "press", None)],
+        "prompt": 70,
+        "skip": 70,
+    },
+    {
+        "name": "seek_past_intro",
+        "chapters": [0, 70, 130, 900, 1800],
+        "events": [(20, "seek", 1000)],
+        "prompt": None,
+        "skip": None,
+    },
+    {
+        "name": "default_auto_skip",
+        "chapters": None,
+        "settings": {"skip_by_default": True},
+        "events": [],
+        "prompt": None,
+        "skip": 90,
+    },
+    {
+        "name": "default_pause_and_seek",
+        "chapters": None,
+        "events": [(20, "pause", None), (60, "resume", None), (70, "seek", 40), (87, "press", None)],
+        "prompt": 55,
+        "skip": 90,
+    },
+    {
+        # at 2x, chapter 2 (70-80) passes in 5 seconds of wall time
+        "name": "fast_forward_short_second",
+        "chapters": [0, 70, 80, 900, 1800],
+        "events": [(10, "speed", 2.0), (41, "press", None)],
+        "prompt": 70,
+        "skip": 80,
+    },
+    {
+        "name": "tempo_change",
+        "chapters": [0, 70, 130, 900, 1800],
+        "events": [(10, "speed", 1.5), (52, "press", None)],
+        "prompt": 70,
+        "skip": 70,
+    },
+    {
+        # the dialog has to come back while still rewinding through chapter 2
+        "name": "rewind_into_intro",
+        "chapters": [0, 70, 130, 900, 1800],
+        "events": [(140, "speed", -2.0), (150, "press", None), (152, "speed", 1.0)],
+        "prompt": 70,
+        "skip": 70,
+    },
+    {
+        # a stream that only reports its duration 30 seconds in
+        "name": "stream_duration_later",
+        "chapters": [0, 70, 130, 900, 1800],
+        "duration_later": True,
+        "events": [(30, "duration", None), (72, "press", None)],
+        "prompt": 70,
+        "skip": 70,
+    },
+    {
+        "name": "learned_marker",
+        "chapters": None,
+        "marker": (30, 85),
+        "events": [(33, "press", None)],
+        "prompt": 30,
+        "skip": 85,
+    },
+]
+
+
+class FakeKodi:
+    """
+    The state behind the fake Kodi modules: a virtual clock, one playing
+    file, the add-on's settings and a count of every API call.
+    """
+
+    def __init__(self, verbose=False, debug_log=False):
+        self.verbose = verbose
+        # whether Kodi's debug logging is on
+        self.debug_log = debug_log
+        self.now = 0.0
+        self.calls = collections.Counter()
+        self.settings = {}
+        self.info = {}
+        self.profile = ""
+        self.file = "/media/Show/Show.S01E01.mkv"
+        self.file_size = 1 << 30
+        self.duration = EPISODE
+        self.playing = False
+        self.paused = False
+        self.speed = 1.0
+        # streams can report no duration until some time after AV start
+        self.duration_known = True
+        self.position = 0.0
+        self.anchor = 0.0
+        # callbacks Kodi would deliver on its own thread
+        self.pending = []
+        self.dialogs = []
+        self.prompts = []
+        self.seeks = []
+        self.labels = []
+
+    def clock(self):
+        return self.now
+
+    def count(self, name):
+        self.calls[name] += 1
+
+    def get_time(self):
+        if self.playing and not self.paused:
+            elapsed = (self.now - self.anchor) * self.speed
+            return max(0.0, min(self.duration, self.position + elapsed))
+        return self.position
+
+    def set_time(self, position):
+        self.position = max(0.0, min(self.duration, position))
+        self.anchor = self.now
+
+    def start(self, session, profile):
+        self.now = 0.0
+        self.calls.clear()
+        self.settings = dict(DEFAULT_SETTINGS, **session.get("settings", {}))
+        self.profile = profile
+        self.info = {
+            "VideoPlayer.TVShowTitle": "Show",
+            "VideoPlayer.Season": "1",
+            "Player.PlaySpeed": "1.00",
+        }
+        chapters = session.get("chapters")
+        if chapters:
+            # Player.Chapters lists each chapter's start and end, in percent
+            bounds = list(chapters[1:]) + [self.duration]
+            percents = []
+            for start, end in zip(chapters, bounds):
+                percents += [100.0 * start / self.duration, 100.0 * end / self.duration]
+            self.info["Player.ChapterCount"] = str(len(chapters))
+            self.info["Player.Chapters"] = ",".join("{:.4f}".format(p) for p in percents)
+        else:
+            self.info["Player.ChapterCount"] = "0"
+            self.info["Player.Chapters"] = ""
+        self.playing = True
+        self.paused = False
+        self.speed = 1.0
+        self.duration_known = not session.get("duration_later")
+        self.set_time(0.0)
+        self.pending = [("onAVStarted", ())]
+        self.dialogs = []
+        self.prompts = []
+        self.seeks = []
+        self.labels = []
+
+
+def install(kodi):
+    """
+    Puts fake xbmc, xbmcgui, xbmcaddon and xbmcvfs modules backed by
+    ``kodi`` into sys.modules.
+    """
+    xbmc = types.ModuleType("xbmc")
+    xbmc.LOGDEBUG, xbmc.LOGINFO, xbmc.LOGWARNING, xbmc.LOGERROR = 0, 1, 2, 3
+
+    def log(message, level=0):
+        kodi.count("log")
+        if kodi.verbose:
+            print("{:9.3f} {}".format(kodi.now, message))
+
+    def getInfoLabel(label):
+        kodi.count("getInfoLabel")
+        return kodi.info.get(label, "")
+
+    def getCondVisibility(condition):
+        kodi.count("getCondVisibility")
+        return kodi.debug_log and condition == "System.GetBool(debug.showloginfo)"
+
+    def executeJSONRPC(request):
+        kodi.count("executeJSONRPC")
+        return json.dumps({"id": 1, "jsonrpc": "2.0", "result": {}})
+
+    class Player:
+        def getTime(self):
+            kodi.count("Player.getTime")
+            return kodi.get_time()
+
+        def getTotalTime(self):
+            kodi.count("Player.getTotalTime")
+            return kodi.duration if kodi.duration_known else 0.0
+
+        def isPlaying(self):
+            kodi.count("Player.isPlaying")
+            return kodi.playing
+
+        def isPlayingVideo(self):
+            kodi.count("Player.isPlayingVideo")
+            return kodi.playing
+
+        def getPlayingFile(self):
+            kodi.count("Player.getPlayingFile")
+            return kodi.file
+
+        def seekTime(self, seconds):
+            kodi.count("Player.seekTime")
+            before = kodi.get_time()
+            kodi.seeks.append((kodi.now, before, seconds))
+            kodi.set_time(seconds)
+            kodi.pending.append(("onPlayBackSeek", (int(seconds * 1000), int((seconds - before) * 1000))))
+
+    class Monitor:
+        def abortRequested(self):
+            kodi.count("Monitor.abortRequested")
+            return False
+
+        def waitForAbort(self, timeout=None):
+            kodi.count("Monitor.waitForAbort")
+            return True
+
+    xbmc.log = log
+    xbmc.getInfoLabel = getInfoLabel
+    xbmc.getCondVisibility = getCondVisibility
+    xbmc.executeJSONRPC = executeJSONRPC
+    xbmc.Player = Player
+    xbmc.Monitor = Monitor
+
+    xbmcgui = types.ModuleType("xbmcgui")
+    xbmcgui.ACTION_PREVIOUS_MENU = 10
+    xbmcgui.ACTION_SELECT_ITEM = 7
+    xbmcgui.ACTION_NAV_BACK = 92
+    xbmcgui.ACTION_MOUSE_LEFT_CLICK = 100
+
+    class Control:
+        def __init__(self, *args, **kwargs):
+            kodi.count(type(self).__name__)
+
+        def setLabel(self, label):
+            kodi.count(type(self).__name__ + ".setLabel")
+            kodi.labels.append((kodi.now, label))
+
+    class WindowDialog:
+        def __init__(self):
+            kodi.count("WindowDialog")
+
+        def getWidth(self):
+            kodi.count("WindowDialog.getWidth")
+            return 1920
+
+        def getHeight(self):
+            kodi.count("WindowDialog.getHeight")
+            return 1080
+
+        def addControl(self, control):
+            kodi.count("WindowDialog.addControl")
+
+        def setFocus(self, control):
+            kodi.count("WindowDialog.setFocus")
+
+        def show(self):
+            kodi.count("WindowDialog.show")
+            kodi.dialogs.append(self)
+            kodi.prompts.append((kodi.now, kodi.get_time()))
+
+        def close(self):
+            kodi.count("WindowDialog.close")
+            if self in kodi.dialogs:
+                kodi.dialogs.remove(self)
+
+    class Action:
+        def __init__(self, action_id):
+            self.action_id = action_id
+
+        def getId(self):
+            return self.action_id
+
+    xbmcgui.ControlImage = type("ControlImage", (Control,), {})
+    xbmcgui.ControlButton = type("ControlButton", (Control,), {})
+    xbmcgui.WindowDialog = WindowDialog
+    xbmcgui.getScreenWidth = lambda: kodi.count("getScreenWidth") or 1920
+    xbmcgui.getScreenHeight = lambda: kodi.count("getScreenHeight") or 1080
+    xbmcgui.Action = Action
+
+    xbmcaddon = types.ModuleType("xbmcaddon")
+
+    class Addon:
+        def getSetting(self, setting):
+            kodi.count("Addon.getSetting")
+            value = kodi.settings.get(setting, "")
+            return str(value).lower() if isinstance(value, bool) else str(value)
+
+        def getSettingBool(self, setting):
+            kodi.count("Addon.getSettingBool")
+            return bool(kodi.settings.get(setting, False))
+
+        def getAddonInfo(self, key):
+            kodi.count("Addon.getAddonInfo")
+            return kodi.profile if key == "profile" else ""
+
+    xbmcaddon.Addon = Addon
+
+    xbmcvfs = types.ModuleType("xbmcvfs")
+
+    class Stat:
+        def __init__(self, path):
+            kodi.count("xbmcvfs.Stat")
+
+        def st_size(self):
+            return kodi.file_size
+
+    xbmcvfs.Stat = Stat
+    xbmcvfs.translatePath = lambda path: path
+
+    sys.modules.update(xbmc=xbmc, xbmcgui=xbmcgui, xbmcaddon=xbmcaddon, xbmcvfs=xbmcvfs)
+
+
+def load_service(kodi):
+    """
+    Imports the addon's default.py against the fake Kodi.
+    """
+    install(kodi)
+    if ADDON_DIR not in sys.path:
+        sys.path.insert(0, ADDON_DIR)
+    import default
+
+    class SimulatedScheduler(default.PlaybackScheduler):
+        """
+        The real scheduler's step() without its thread: the harness decides
+        when the next step runs.
+        """
+
+        def __init__(self, player):
+            super().__init__(player)
+            self.woken = False
+
+        def wake(self):
+            self.woken = True
+
+    return default, SimulatedScheduler
+
+
+def run_session(kodi, default, scheduler_class, session, length=600.0, poll=None):
+    profile = tempfile.mkdtemp(prefix="skipintro_bench_")
+    try:
+        kodi.start(session, profile)
+        if session.get("marker"):
+            from resources.lib import markers
+
+            store = markers.MarkerStore(os.path.join(profile, "markers.db"))
+            store.put(markers.file_key(kodi.file, kodi.file_size), *session["marker"], source="audio")
+            store.close()
+        default.metrics = default.diagnostics.Metrics()
+        player = default.SkipIntroPlayer(clock=kodi.clock)
+        scheduler = scheduler_class(player)
+        player.scheduler = scheduler
+        events = sorted(session["events"], key=lambda event: event[0])
+
+        cpu = 0.0
+        steps = 0
+        next_step = 0.0
+        while True:
+            start = time.process_time()
+            while kodi.pending:
+                name, args = kodi.pending.pop(0)
+                getattr(player, name)(*args)
+            cpu += time.process_time() - start
+            # the polling loop can't be woken early
+            if scheduler.woken and not poll:
+                next_step = kodi.now
+            scheduler.woken = False
+
+            next_event = events[0][0] if events else length
+            if next_step <= min(next_event, length):
+                kodi.now = next_step
+                start = time.process_time()
+                timeout = scheduler.step()
+                cpu += time.process_time() - start
+                steps += 1
+                next_step = kodi.now + (poll or timeout)
+            elif events and next_event < length:
+                kodi.now, action, argument = events.pop(0)
+                apply_event(kodi, action, argument)
+            else:
+                kodi.now = length
+                break
+
+        player.remove_skip_dialog()
+        if player.marker_store is not None:
+            player.marker_store.close()
+    finally:
+        shutil.rmtree(profile, ignore_errors=True)
+
+    result = score(kodi, session, length, cpu, steps, list(player.time_to_visible))
+    result["service_metrics"] = default.metrics.snapshot()
+    return result
+
+
+def apply_event(kodi, action, argument):
+    if action == "seek":
+        before = kodi.get_time()
+        kodi.set_time(argument)
+        kodi.pending.append(("onPlayBackSeek", (int(argument * 1000), int((argument - before) * 1000))))
+    elif action == "pause":
+        kodi.set_time(kodi.get_time())
+        kodi.paused = True
+        kodi.pending.append(("onPlayBackPaused", ()))
+    elif action == "resume":
+        kodi.paused = False
+        kodi.set_time(kodi.position)
+        kodi.pending.append(("onPlayBackResumed", ()))
+    elif action == "speed":
+        kodi.set_time(kodi.get_time())
+        kodi.speed = argument
+        kodi.info["Player.PlaySpeed"] = "{:.2f}".format(argument)
+        # Kodi passes the speed as an integer, so tempo changes look like 1x
+        kodi.pending.append(("onPlayBackSpeedChanged", (int(argument),)))
+    elif action == "duration":
+        kodi.duration_known = True
+    elif action == "press":
+        # the user presses OK on the dialog, if there is one
+        if kodi.dialogs:
+            import xbmcgui
+
+            kodi.dialogs[-1].onAction(xbmcgui.Action(xbmcgui.ACTION_SELECT_ITEM))
+    elif action == "stop":
+        kodi.set_time(kodi.get_time())
+        kodi.playing = False
+        kodi.pending.append(("onPlayBackStopped", ()))
+    else:
+        raise ValueError("unknown action: {}".format(action))
+
+
+def score(kodi, session, length, cpu, steps, time_to_visible):
+    api_calls = sum(count for name, count in kodi.calls.items() if name != "log")
+    prompt = kodi.prompts[0][1] if kodi.prompts else None
+    skip = kodi.seeks[0][2] if kodi.seeks else None
+    prompt_latency = prompt - session["prompt"] if prompt is not None and session["prompt"] is not None else None
+    skip_error = skip - session["skip"] if skip is not None and session["skip"] is not None else None
+    ok = (
+        (prompt is None) == (session["prompt"] is None)
+        and (skip is None) == (session["skip"] is None)
+        and (prompt_latency is None or abs(prompt_latency) <= TOLERANCE)
+        and (skip_error is None or abs(skip_error) <= TOLERANCE)
+    )
+    return {
+        "name": session["name"],
+        "ok": ok,
+        "prompt_at": prompt,
+        "prompt_latency_s": prompt_latency,
+        "skip_to": skip,
+        "skip_error_s": skip_error,
+        "api_calls_per_min": api_calls * 60.0 / length,
+        "log_lines_per_min": kodi.calls["log"] * 60.0 / length,
+        "wakeups_per_hour": steps * 3600.0 / length,
+        "cpu_ms_per_hour": cpu * 1000 * 3600.0 / length,
+        "prompts": len(kodi.prompts),
+        "dialog_builds": kodi.calls["WindowDialog"],
+        "time_to_visible_ms": max(time_to_visible) * 1000 if time_to_visible else None,
+        "countdown_labels": [label for _, label in kodi.labels],
+        "api_calls": dict(kodi.calls),
+    }
+
+
+def benchmark(length=600.0, poll=None, verbose=False, names=None, debug_log=False):
+    kodi = FakeKodi(verbose, debug_log)
+    default, scheduler_class = load_service(kodi)
+    sessions = [session for session in SESSIONS if not names or session["name"] in names]
+    return [run_session(kodi, default, scheduler_class, session, length, poll) for session in sessions]
+
+
+def _seconds(value):
+    return "-" if value is None else "{:.2f}s".format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Skip Intro service against a fake Kodi.")
+    parser.add_argument("sessions", nargs="*", help="sessions to run (default: all)")
+    parser.add_argument("--length", type=float, default=600, help="seconds of playback per session")
+    parser.add_argument("--poll", type=float, help="poll every POLL seconds instead of using the scheduler's waits")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the service's log")
+    parser.add_argument("--debug-log", action="store_true", help="run as if Kodi's debug logging were on")
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.length, args.poll, args.verbose, args.sessions, args.debug_log)
+    print(
+        "{:<26} {:>6} {:>8} {:>8} {:>9} {:>8} {:>10} {:>9} {:>12}".format(
+            "session", "", "prompt", "skip", "calls/min", "logs/min", "wakeups/h", "cpu ms/h", "shown/built"
+        )
+    )
+    for result in results:
+        print(
+            "{:<26} {} {:>8} {:>8} {:>9.1f} {:>8.1f} {:>10.0f} {:>9.1f} {:>12}".format(
+                result["name"],
+                color_text("  ok  " if result["ok"] else " FAIL ", "green" if result["ok"] else "red"),
+                _seconds(result["prompt_latency_s"]),
+                _seconds(result["skip_error_s"]),
+                result["api_calls_per_min"],
+                result["log_lines_per_min"],
+                result["wakeups_per_hour"],
+                result["cpu_ms_per_hour"],
+                "{}/{}".format(result["prompts"], result["dialog_builds"]),
+            )
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
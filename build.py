@@ -1,13 +1,79 @@
+import argparse
+import cProfile
+import hashlib
+import json
 import os
 import shutil
 import re
-import subprocess
 from xml.etree import ElementTree as ET
 
-def delete_folder(folder_path):
-    if os.path.exists(folder_path):
-        shutil.rmtree(folder_path)
-        print(f"Deleted folder: {folder_path}")
+from _repo_generator import CACHE_DIR, IGNORE, KODI_VERSIONS, ArtifactStore, BuildStats, Generator
+
+ADDON_XML = 'repo/repository.skipintro/addon.xml'
+STAGES_PATH = os.path.join(CACHE_DIR, 'build_stages.json')
+
+stats = BuildStats()
+
+class Stage:
+    """
+    A build step with declared input and output paths. The step is skipped
+    when its inputs, outputs and parameters all match what they were right
+    after its last successful run.
+    """
+
+    def __init__(self, name, func, inputs, outputs, params=()):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = list(params)
+
+    def fingerprint(self):
+        digest = hashlib.sha256(json.dumps(self.params).encode('utf-8'))
+        for path in self.inputs + self.outputs:
+            digest.update(path_fingerprint(path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def run(self, state, force=False):
+        if not force and all(os.path.exists(p) for p in self.outputs) \
+                and state.get(self.name) == self.fingerprint():
+            print(f"Skipping {self.name}: up to date")
+            return
+        with stats.stage(self.name):
+            self.func()
+        state[self.name] = self.fingerprint()
+
+def path_fingerprint(path):
+    """
+    Returns a cheap fingerprint (sizes and mtimes, no file reads) of a file,
+    or of every file under a folder except the generator's output.
+    """
+    if not os.path.exists(path):
+        return f'{path}:missing'
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return f'{path}:{st.st_size}:{st.st_mtime_ns}'
+
+    parts = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in IGNORE and d not in ('zips', CACHE_DIR))
+        for f in sorted(files):
+            st = os.stat(os.path.join(root, f))
+            parts.append(f'{os.path.join(root, f)}:{st.st_size}:{st.st_mtime_ns}')
+    return '\n'.join(parts)
+
+def load_state():
+    try:
+        with open(STAGES_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state):
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    with open(STAGES_PATH, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
 
 def delete_file(file_path):
     if os.path.exists(file_path):
@@ -21,16 +87,16 @@ def update_addon_xml(file_path):
         root = tree.getroot()
         print(f"Root tag: {root.tag}")
         print(f"Root attributes: {root.attrib}")
-        
+
         if root.tag != 'addon':
             print("Error: Root element is not 'addon'.")
             return None
-        
+
         current_version = root.get('version')
         if current_version is None:
             print("Error: 'version' attribute not found in the 'addon' element.")
             return None
-        
+
         print(f"Current addon.xml version: {current_version}")
         return current_version
     except Exception as e:
@@ -40,9 +106,9 @@ def update_addon_xml(file_path):
 def update_index_html(file_path, new_version):
     with open(file_path, 'r') as file:
         content = file.read()
-    
+
     updated_content = re.sub(r'plugin\.video\.skipintro-\d+\.\d+\.\d+\.zip', f'plugin.video.skipintro-{new_version}.zip', content)
-    
+
     if updated_content != content:
         with open(file_path, 'w') as file:
             file.write(updated_content)
@@ -51,39 +117,78 @@ def update_index_html(file_path, new_version):
         print("Warning: No changes were made to index.html. The version might already be up to date.")
 
 def run_repo_generator():
-    subprocess.run(['python', '_repo_generator.py'], check=True)
-    print("Ran _repo_generator.py successfully")
+    store = ArtifactStore(os.path.join(CACHE_DIR, 'store'))
+    releases = [r for r in KODI_VERSIONS if os.path.exists(r)]
+    for release in releases:
+        Generator(release, stats=stats, store=store)
+    store.prune([os.path.join(release, 'zips') for release in releases])
+    print(f"Generated the repository for {', '.join(releases)}")
+
+def addon_zip_path(version):
+    return f'repo/zips/plugin.video.skipintro/plugin.video.skipintro-{version}.zip'
 
 def copy_new_zip_to_root(new_version):
-    source_path = f'repo/zips/plugin.video.skipintro/plugin.video.skipintro-{new_version}.zip'
+    source_path = addon_zip_path(new_version)
     destination_path = f'plugin.video.skipintro-{new_version}.zip'
     shutil.copy2(source_path, destination_path)
     print(f"Copied new addon zip to root: {destination_path}")
 
-def main():
-    # Delete 'zips' folder
-    delete_folder('repo/zips')
-
-    # Delete addon zip in root folder
+def publish_zip(new_version):
+    # Delete any other addon zip in root folder
     for file in os.listdir():
-        if file.startswith('plugin.video.skipintro-') and file.endswith('.zip'):
+        if file.startswith('plugin.video.skipintro-') and file.endswith('.zip') \
+                and file != f'plugin.video.skipintro-{new_version}.zip':
             delete_file(file)
 
+    copy_new_zip_to_root(new_version)
+
+def pipeline(current_version):
+    release_inputs = [r for r in KODI_VERSIONS if os.path.exists(r)]
+    return [
+        Stage('update_index_html', lambda: update_index_html('index.html', current_version),
+              inputs=[], outputs=['index.html'], params=[current_version]),
+        Stage('repo_generator', run_repo_generator,
+              inputs=release_inputs,
+              outputs=['repo/zips/addons.xml', 'repo/zips/addons.xml.gz', 'repo/zips/checksums.sha256',
+                       addon_zip_path(current_version), addon_zip_path(current_version) + '.sha256']),
+        Stage('publish_zip', lambda: publish_zip(current_version),
+              inputs=[addon_zip_path(current_version)],
+              outputs=[f'plugin.video.skipintro-{current_version}.zip']),
+    ]
+
+def main(force=False):
     # Check addon.xml and get current version
-    current_version = update_addon_xml('repo/repository.skipintro/addon.xml')
+    with stats.stage('read_version'):
+        current_version = update_addon_xml(ADDON_XML)
     if current_version is None:
         print("Failed to read addon.xml. Build process aborted.")
         return
 
-    # Update index.html
-    update_index_html('index.html', current_version)
+    state = load_state()
+    try:
+        for stage in pipeline(current_version):
+            stage.run(state, force)
+    finally:
+        save_state(state)
 
-    # Run _repo_generator.py
-    run_repo_generator()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the Skip Intro repository.")
+    parser.add_argument('--force', action='store_true', help="run every stage, even if it is up to date")
+    parser.add_argument('--report', metavar='PATH', help="write per-stage build costs to a JSON file")
+    parser.add_argument('--profile', metavar='PATH', help="write a cProfile dump of the build")
+    parser.add_argument('--timings', action='store_true', help="print a per-stage summary")
+    args = parser.parse_args()
 
-    # Copy new zip file to root
-    copy_new_zip_to_root(current_version)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    main(args.force)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
 
-if __name__ == "__main__":
-    main()
+    if args.timings:
+        stats.print_summary()
+    if args.report:
+        stats.write(args.report)
     print("Build process completed successfully.")
@@ -49,6 +49,7 @@ echo "Release directory: $RELEASE_DIR"
 rm -f "$RELEASE_DIR"/plugin.video.skipintro-*.zip
 rm -f "$RELEASE_DIR"/repository.plugin.video.skipintro.xml
 rm -f "$RELEASE_DIR"/repository.plugin.video.skipintro.zip
+rm -f "$RELEASE_DIR"/addons.xml.gz "$RELEASE_DIR"/addons.xml.gz.md5
 
 # Create temporary build directory
 BUILD_DIR=$(mktemp -d)
@@ -85,9 +86,13 @@ cat > "$RELEASE_DIR/addons.xml" << EOF
 </addons>
 EOF
 
+# Generate the compressed index (no name or timestamp, so it's reproducible)
+gzip -9 -n -c "$RELEASE_DIR/addons.xml" > "$RELEASE_DIR/addons.xml.gz"
+
 # Generate MD5
 cd "$RELEASE_DIR"
 md5sum addons.xml > addons.xml.md5
+md5sum addons.xml.gz > addons.xml.gz.md5
 cd "$REPO_DIR"
 
 # Create repository XML
@@ -98,8 +103,8 @@ cat > release/repository.plugin.video.skipintro.xml << EOF
        version="$VERSION" 
        provider-name="Amgad Abdelhafez">
     <extension point="xbmc.addon.repository" name="Skip Intro Repository">
-        <info compressed="false">https://github.com/amgadabdelhafez/plugin.video.skipintro/raw/main/repository.xml</info>
-        <checksum>https://github.com/amgadabdelhafez/plugin.video.skipintro/raw/main/repository.md5</checksum>
+        <info compressed="true">https://github.com/amgadabdelhafez/plugin.video.skipintro/raw/main/addons.xml.gz</info>
+        <checksum>https://github.com/amgadabdelhafez/plugin.video.skipintro/raw/main/addons.xml.gz.md5</checksum>
         <datadir zip="true">https://github.com/amgadabdelhafez/plugin.video.skipintro/raw/main/</datadir>
         <assets>
             <icon>https://github.com/amgadabdelhafez/plugin.video.skipintro/raw/main/icon.png</icon>
@@ -1,17 +1,68 @@
 import xbmc # type: ignore
 import xbmcgui # type: ignore
 import xbmcaddon # type: ignore
+import xbmcvfs # type: ignore
 import re
 import os
+import math
+import threading
+from array import array
+from collections import deque
+from bisect import bisect_right
 import time
 import json
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
+
+from resources.lib import diagnostics, markers, subtitles
+from resources.lib.prescan import Prescanner
 
 addon = xbmcaddon.Addon()
+log = diagnostics.Logger(xbmc.log, (xbmc.LOGDEBUG, xbmc.LOGINFO, xbmc.LOGWARNING, xbmc.LOGERROR), 'skipintro: ')
+metrics = diagnostics.Metrics()
+
+def refresh_log_level():
+    # Kodi drops debug messages unless debug logging is on, so don't even
+    # format them then
+    debug = xbmc.getCondVisibility('System.GetBool(debug.showloginfo)')
+    log.level = diagnostics.DEBUG if debug else diagnostics.INFO
+
+def info_label(label: str) -> str:
+    metrics.count('api.getInfoLabel')
+    return xbmc.getInfoLabel(label)
+
+def profile_path(name: str) -> str:
+    profile = xbmcvfs.translatePath(addon.getAddonInfo('profile'))
+    os.makedirs(profile, exist_ok=True)
+    return os.path.join(profile, name)
+
+def unwatched_episodes(page_size: int = 200):
+    """
+    Yields (file, series key) for the library's unwatched episodes, a page
+    of JSON-RPC results at a time.
+    """
+    start = 0
+    while True:
+        request = {
+            'jsonrpc': '2.0', 'id': 1, 'method': 'VideoLibrary.GetEpisodes',
+            'params': {
+                'filter': {'field': 'playcount', 'operator': 'is', 'value': '0'},
+                'properties': ['file', 'showtitle', 'season'],
+                'limits': {'start': start, 'end': start + page_size},
+            },
+        }
+        metrics.count('api.executeJSONRPC')
+        result = json.loads(xbmc.executeJSONRPC(json.dumps(request))).get('result', {})
+        episodes = result.get('episodes', [])
+        for episode in episodes:
+            yield episode['file'], markers.series_key(episode.get('showtitle'), episode.get('season'))
+        start += len(episodes)
+        if not episodes or start >= result.get('limits', {}).get('total', 0):
+            return
 
 class SkipIntroDialog(xbmcgui.WindowDialog):
-    def __init__(self):
+    def __init__(self, on_close=None):
         super(SkipIntroDialog, self).__init__()
+        self.on_close = on_close
         # Get screen dimensions
         self.screen_width = self.getWidth()
         self.screen_height = self.getHeight()
@@ -36,9 +87,31 @@ class SkipIntroDialog(xbmcgui.WindowDialog):
                                                  textColor='0xFFFFFFFF')
         self.addControl(self.skip_button)
         self.setFocus(self.skip_button)
+        self.label = "Skip Intro"
         
         self.button_pressed = False
 
+    def show(self):
+        # the dialog is reused, so each prompt starts unpressed
+        self.button_pressed = False
+        super(SkipIntroDialog, self).show()
+
+    def close(self):
+        super(SkipIntroDialog, self).close()
+        if self.on_close:
+            self.on_close()
+
+    def set_countdown(self, seconds: Optional[float]):
+        """
+        Shows the seconds left in the intro on the button, or the plain label
+        for None. The button is relabelled in place, and only when the
+        whole seconds change.
+        """
+        label = "Skip Intro" if seconds is None else f"Skip Intro ({math.ceil(seconds)})"
+        if label != self.label:
+            self.skip_button.setLabel(label)
+            self.label = label
+
     def onAction(self, action):
         if action.getId() in [xbmcgui.ACTION_NAV_BACK, xbmcgui.ACTION_PREVIOUS_MENU]:
             self.close()
@@ -51,17 +124,77 @@ class SkipIntroDialog(xbmcgui.WindowDialog):
             self.button_pressed = True
             self.close()
 
+class ChapterTimeline:
+    """
+    Chapter start times of the playing stream, converted from Kodi's
+    percentages to absolute seconds once, so lookups are a bisect instead
+    of a scan plus a getTotalTime() round-trip. Chapters are numbered from 1.
+    """
+
+    def __init__(self, percents: List[float], total_duration: float):
+        self.total_duration = total_duration
+        self.percents = array('d', percents)
+        self.starts = array('d', (self.to_seconds(percent) for percent in percents))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def to_seconds(self, percent: float) -> float:
+        return (percent / 100) * self.total_duration
+
+    def chapter_at(self, seconds: float) -> int:
+        """
+        Returns the chapter playing at ``seconds``, or 0 before the first one.
+        """
+        return bisect_right(self.starts, seconds)
+
+    def start(self, chapter: int) -> float:
+        return self.starts[chapter - 1]
+
+    def percent(self, chapter: int) -> float:
+        return self.percents[chapter - 1]
+
+# a prompt this late after its due time came from a seek, not the scheduler
+PROMPT_LATENCY_LIMIT = 5.0
+# how often to check while rewinding, when nothing ahead gets closer
+REWIND_POLL = 1.0
+# how often to check for the duration of a stream that hasn't reported it
+DURATION_POLL = 1.0
+
 class SkipIntroPlayer(xbmc.Player):
-    def __init__(self):
+    def __init__(self, clock: Callable[[], float] = time.time):
         super().__init__()
+        # wall clock for dialog timeouts; a harness can pass a simulated one
+        self.clock = clock
         self.intro_bookmark: Optional[float] = None
         self.chapters: Optional[List[Dict[str, float]]] = None
+        self.timeline: Optional[ChapterTimeline] = None
         self.current_chapter: int = 0
         self.skip_dialog: Optional[SkipIntroDialog] = None
         self.dialog_start_time: float = 0
         self.has_skipped: bool = False
         self.using_default_skip: bool = False
         self.max_dialog_duration: float = 60.0  # Maximum duration for skip intro dialog in seconds
+        self.paused: bool = False
+        # the stream hasn't reported its duration yet
+        self.awaiting_duration: bool = False
+        # playback seconds per wall-clock second
+        self.speed: float = 1.0
+        self.scheduler: Optional['PlaybackScheduler'] = None
+        self._lock = threading.RLock()
+        self.marker_store: Optional[markers.MarkerStore] = self._open_marker_store()
+        self.marker: Optional[markers.Marker] = None
+        self.file_key: Optional[str] = None
+        self.series_key: Optional[str] = None
+        self.prompt_time: float = 0
+        self.prescanner: Optional[Prescanner] = None
+        # the dialog is built once per screen resolution and then only
+        # shown and hidden
+        self.dialog_cache: Optional[SkipIntroDialog] = None
+        self.dialog_resolution: Optional[Tuple[int, int]] = None
+        self.time_to_visible: deque = deque(maxlen=100)
+        # where the last skip seeked to, until Kodi reports the seek done
+        self.skip_target: Optional[float] = None
 
         self.default_delay = self._get_setting_int('default_delay', 60)
         self.skip_duration = self._get_setting_int('skip_duration', 30)
@@ -71,112 +204,301 @@ class SkipIntroPlayer(xbmc.Player):
         self.dialog_display_duration = self._get_setting_int('dialog_display_duration', 5)
         self.skip_by_default = addon.getSettingBool('skip_by_default')
         self.use_default_skip_fallback = addon.getSettingBool('use_default_skip_fallback')
+        self.show_countdown = addon.getSettingBool('show_countdown')
 
-        xbmc.log(f'skipintro: Initialized with default_delay: {self.default_delay}, skip_duration: {self.skip_duration}, '
-                 f'skip_by_default: {self.skip_by_default}, use_default_skip_fallback: {self.use_default_skip_fallback}, '
-                 f'skip_to_chapter: {self.skip_to_chapter}, seconds_before_skip: {self.seconds_before_skip}, '
-                 f'chapter_diff_threshold: {self.chapter_diff_threshold}, dialog_display_duration: {self.dialog_display_duration}', 
-                 xbmc.LOGDEBUG)
+        log.debug('Initialized with default_delay: %s, skip_duration: %s, skip_by_default: %s, '
+                  'use_default_skip_fallback: %s, skip_to_chapter: %s, seconds_before_skip: %s, '
+                  'chapter_diff_threshold: %s, dialog_display_duration: %s',
+                  self.default_delay, self.skip_duration, self.skip_by_default, self.use_default_skip_fallback,
+                  self.skip_to_chapter, self.seconds_before_skip, self.chapter_diff_threshold,
+                  self.dialog_display_duration)
 
     def _get_setting_int(self, setting: str, default: int) -> int:
         try:
             return int(addon.getSetting(setting))
         except ValueError:
-            xbmc.log(f'skipintro: Error reading {setting} setting. Using default value: {default}', xbmc.LOGWARNING)
+            log.warning('Error reading %s setting. Using default value: %s', setting, default)
             return default
 
+    def _open_marker_store(self) -> Optional[markers.MarkerStore]:
+        try:
+            return markers.MarkerStore(profile_path('markers.db'))
+        except Exception as e:
+            log.warning('Intro marker cache unavailable: %s', e)
+            return None
+
+    def _identify_stream(self) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Returns the playing file's path and the marker store's file and
+        series keys for it.
+        """
+        try:
+            path = self.getPlayingFile()
+            size = xbmcvfs.Stat(path).st_size()
+        except Exception as e:
+            log.debug('Cannot identify the playing file: %s', e)
+            return None, None, None
+        show = info_label('VideoPlayer.TVShowTitle')
+        season = info_label('VideoPlayer.Season')
+        return path, markers.file_key(path, size), markers.series_key(show, season)
+
+    def _detect_subtitle_marker(self, path: str, file_key: str):
+        """
+        Detects the intro from a local subtitle sidecar of ``path``, for
+        files the library scan hasn't covered. Runs on its own thread, so
+        playback start never waits on it; the marker is only taken up if the
+        file is still playing and nothing has been prompted for it yet.
+        """
+        try:
+            if not os.path.isfile(path):
+                return
+            sidecar = subtitles.find_sidecar(path)
+            intro = subtitles.detect(sidecar) if sidecar else None
+        except Exception as e:
+            log.debug('Cannot read subtitles: %s', e)
+            return
+        if intro is None:
+            return
+        with self._lock:
+            if self.file_key != file_key:
+                return
+            self._learn_marker(intro[0], intro[1], 'subtitles', False)
+            if self.has_skipped or self.skip_dialog or (self.marker and self.marker.source != 'series'):
+                return
+            log.info('Using subtitles intro marker %.2f-%.2f', intro[0], intro[1])
+            self.marker = markers.Marker(intro[0], intro[1], 'subtitles', False)
+            self.using_default_skip = False
+            self.intro_bookmark = None
+            self._get_dialog()
+        self._wake_scheduler()
+
+    def _learn_marker(self, start: float, end: float, source: str, confirmed: bool):
+        if self.marker_store is not None and self.file_key:
+            if self.marker_store.put(self.file_key, start, end, self.series_key, source, confirmed):
+                log.debug('Learned %s intro marker %.2f-%.2f', source, start, end)
+
+    def _read_speed(self, fallback: float) -> float:
+        """
+        Returns the playback speed, including tempo changes, which Kodi
+        reports to onPlayBackSpeedChanged as plain 1x.
+        """
+        try:
+            return float(info_label('Player.PlaySpeed'))
+        except ValueError:
+            return float(fallback)
+
+    def _wall_seconds(self, playback_seconds: float) -> float:
+        """
+        Converts a stretch of playback time into the wall time it takes at
+        the current speed.
+        """
+        if self.speed == 1.0:
+            return playback_seconds
+        if self.speed <= 0:
+            return REWIND_POLL
+        return playback_seconds / self.speed
+
+    def _wake_scheduler(self):
+        if self.scheduler:
+            self.scheduler.wake()
+
+    # Kodi API calls are counted, so a metrics dump shows what a tick costs
+    def getTime(self) -> float:
+        metrics.count('api.getTime')
+        return super().getTime()
+
+    def getTotalTime(self) -> float:
+        metrics.count('api.getTotalTime')
+        return super().getTotalTime()
+
+    def isPlaying(self) -> bool:
+        metrics.count('api.isPlaying')
+        return super().isPlaying()
+
+    def getPlayingFile(self) -> str:
+        metrics.count('api.getPlayingFile')
+        return super().getPlayingFile()
+
+    def seekTime(self, seek_time: float):
+        metrics.count('api.seekTime')
+        super().seekTime(seek_time)
+
     def onAVStarted(self):
-        xbmc.log('skipintro: AV started', xbmc.LOGDEBUG)
-        self.chapters = self.getChapters()
-        self.has_skipped = False
-        self.current_chapter = 0
-        self.using_default_skip = False
-        if self.chapters:
-            xbmc.log(f'skipintro: Found {len(self.chapters)} chapters', xbmc.LOGDEBUG)
-            self.intro_bookmark = self.find_intro_chapter(self.chapters)
-        elif self.use_default_skip_fallback:
-            xbmc.log('skipintro: No chapters found. Using default skip as fallback.', xbmc.LOGINFO)
-            self.using_default_skip = True
-            self.intro_bookmark = self.default_delay
+        log.debug('AV started')
+        refresh_log_level()
+        metrics.count('playbacks')
+        # the library scan waits until playback is over
+        if self.prescanner:
+            self.prescanner.pause()
+        with self._lock:
+            self.remove_skip_dialog()
+            self.chapters = self.getChapters()
+            self.timeline = None
+            if self.chapters:
+                self.timeline = ChapterTimeline(
+                    [chapter['start'] for chapter in self.chapters], self.getTotalTime()
+                )
+            self.has_skipped = False
+            self.current_chapter = 0
+            self.using_default_skip = False
+            self.intro_bookmark = None
+            self.paused = False
+            self.awaiting_duration = False
+            self.speed = self._read_speed(1.0)
+            self.marker = None
+            path, self.file_key, self.series_key = self._identify_stream()
+            marker = None
+            if self.marker_store is not None and self.file_key:
+                marker = self.marker_store.get(self.file_key, self.series_key)
+            if not self.chapters and (marker is None or marker.source == 'series') and self.file_key:
+                threading.Thread(target=self._detect_subtitle_marker, args=(path, self.file_key),
+                                 name='skipintro.subtitles', daemon=True).start()
+            # a season's average is only a guess, so this file's chapters win
+            if marker and (marker.source != 'series' or not self.chapters):
+                log.info('Using %s intro marker %.2f-%.2f', marker.source, marker.start, marker.end)
+                self.marker = marker
+            elif self.chapters:
+                log.debug('Found %d chapters', len(self.chapters))
+                self.intro_bookmark = self.find_intro_chapter(self.timeline)
+            elif self.use_default_skip_fallback:
+                log.info('No chapters found. Using default skip as fallback.')
+                self.using_default_skip = True
+                self.intro_bookmark = self.default_delay
+            # build the dialog now, while nothing is waiting on it
+            if self.marker or self.intro_bookmark is not None:
+                self._get_dialog()
+        self._wake_scheduler()
+
+    # Anything that moves the playhead or changes how fast it moves
+    # invalidates the scheduler's next wake-up time.
+    def onPlayBackSeek(self, seek_time, seek_offset):
+        if self.skip_target is not None:
+            metrics.observe('skip_error_seconds', abs(self.getTime() - self.skip_target))
+            self.skip_target = None
+        self._wake_scheduler()
+
+    def onPlayBackSeekChapter(self, chapter):
+        self._wake_scheduler()
+
+    def onPlayBackSpeedChanged(self, speed):
+        self.speed = self._read_speed(speed)
+        log.debug('Playback speed changed to %.2f', self.speed)
+        self._wake_scheduler()
+
+    def onPlayBackPaused(self):
+        self.paused = True
+        self._wake_scheduler()
+
+    def onPlayBackResumed(self):
+        self.paused = False
+        self._wake_scheduler()
+
+    def onPlayBackStopped(self):
+        with self._lock:
+            self.remove_skip_dialog()
+        if self.prescanner:
+            self.prescanner.resume()
+        self._wake_scheduler()
+
+    def onPlayBackEnded(self):
+        self.onPlayBackStopped()
+
+    def onPlayBackError(self):
+        self.onPlayBackStopped()
 
     def getChapters(self) -> Optional[List[Dict[str, float]]]:
-        chapter_count = int(xbmc.getInfoLabel('Player.ChapterCount'))
-        xbmc.log(f'skipintro: Total chapters found: {chapter_count}', xbmc.LOGDEBUG)
+        chapter_count = int(info_label('Player.ChapterCount'))
+        log.debug('Total chapters found: %d', chapter_count)
 
         if chapter_count == 0:
-            xbmc.log('skipintro: No chapters found in the video.', xbmc.LOGINFO)
+            log.info('No chapters found in the video.')
             return None
 
-        raw_chapters = xbmc.getInfoLabel('Player.Chapters')
-        xbmc.log(f'skipintro: Raw Chapters found: {raw_chapters}', xbmc.LOGDEBUG)
+        raw_chapters = info_label('Player.Chapters')
+        log.debug('Raw Chapters found: %s', raw_chapters)
 
         if not raw_chapters:
-            xbmc.log('skipintro: Raw chapters string is empty.', xbmc.LOGINFO)
+            log.info('Raw chapters string is empty.')
             return None
 
         try:
             chapter_times = [float(time) for time in raw_chapters.split(',') if time.strip()]
         except ValueError as e:
-            xbmc.log(f'skipintro: Error parsing chapter times: {str(e)}', xbmc.LOGERROR)
+            log.error('Error parsing chapter times: %s', e)
             return None
 
         if not chapter_times:
-            xbmc.log('skipintro: No valid chapter times found.', xbmc.LOGINFO)
+            log.info('No valid chapter times found.')
             return None
 
         start_times = chapter_times[::2] + [chapter_times[-1]]
         
         chapters = [{'name': f"Chapter {i + 1}", 'start': start_time} for i, start_time in enumerate(start_times)]
 
-        for chapter in chapters:
-            xbmc.log(f'skipintro: {chapter["name"]} - Start: {chapter["start"]:.2f}', xbmc.LOGDEBUG)
+        log.debug('Chapter starts (%%): %s', start_times)
 
         return chapters
 
-    def find_intro_chapter(self, chapters: List[Dict[str, float]]) -> Optional[float]:
-        if len(chapters) >= 3 and self.skip_to_chapter == 2:
-            ch2_start = chapters[1]['start']
-            ch3_start = chapters[2]['start']
-            total_duration = self.getTotalTime()
-            
-            ch2_time = (ch2_start / 100) * total_duration
-            ch3_time = (ch3_start / 100) * total_duration
-            
-            time_diff = ch3_time - ch2_time
+    def find_intro_chapter(self, timeline: ChapterTimeline) -> Optional[float]:
+        if len(timeline) >= 3 and self.skip_to_chapter == 2:
+            time_diff = timeline.start(3) - timeline.start(2)
             
             if time_diff < self.chapter_diff_threshold:
-                xbmc.log(f'skipintro: Difference between Ch2 and Ch3 is less than {self.chapter_diff_threshold} seconds. Skipping to Ch3.', xbmc.LOGINFO)
-                return ch3_start  # Return the exact start time of chapter 3
+                log.info('Difference between Ch2 and Ch3 is less than %s seconds. Skipping to Ch3.', self.chapter_diff_threshold)
+                return timeline.percent(3)  # Return the exact start time of chapter 3
             else:
-                xbmc.log('skipintro: Using default Ch2 for skipping.', xbmc.LOGINFO)
-                return ch2_start
-        elif len(chapters) >= self.skip_to_chapter:
-            chapter_start = chapters[self.skip_to_chapter - 1]['start']
-            xbmc.log(f'skipintro: Chapter {self.skip_to_chapter} starts at {chapter_start:.2f}%', xbmc.LOGINFO)
+                log.info('Using default Ch2 for skipping.')
+                return timeline.percent(2)
+        elif len(timeline) >= self.skip_to_chapter:
+            chapter_start = timeline.percent(self.skip_to_chapter)
+            log.info('Chapter %s starts at %.2f%%', self.skip_to_chapter, chapter_start)
             return chapter_start
         else:
-            xbmc.log('skipintro: Not enough chapters found. Cannot skip intro.', xbmc.LOGINFO)
+            log.info('Not enough chapters found. Cannot skip intro.')
             return None
 
+    def _refresh_timeline(self) -> float:
+        """
+        Rebuilds the timeline once the stream knows its duration (streams
+        and network sources can report 0 at AV start), and returns it.
+        """
+        if self.timeline.total_duration > 0:
+            return self.timeline.total_duration
+        total_duration = self.getTotalTime()
+        if total_duration > 0:
+            log.debug('Duration now known: %.2f seconds', total_duration)
+            self.timeline = ChapterTimeline(list(self.timeline.percents), total_duration)
+            # the skip point compared chapter lengths that were all zero
+            if not self.marker and not self.using_default_skip:
+                self.intro_bookmark = self.find_intro_chapter(self.timeline)
+        return total_duration
+
     def check_chapter_and_prompt(self):
         if self.has_skipped:
             return
 
-        total_duration = self.getTotalTime()
+        total_duration = self._refresh_timeline() if self.timeline else self.getTotalTime()
         current_time = self.getTime()
 
-        if total_duration <= 0:
-            xbmc.log('skipintro: Total duration is zero or negative. Skipping percentage calculation.', xbmc.LOGWARNING)
+        self.awaiting_duration = total_duration <= 0
+        if self.awaiting_duration:
+            log.warning('Total duration is zero or negative. Skipping chapter lookup.')
             return
 
-        try:
-            current_percentage = (current_time / total_duration) * 100
-        except ZeroDivisionError:
-            xbmc.log('skipintro: Error calculating current percentage. Total duration is zero.', xbmc.LOGERROR)
+        if self.marker:
+            if self.marker.start <= current_time < self.marker.end:
+                if self.skip_by_default:
+                    self.skip_to_intro_end()
+                elif not self.skip_dialog:
+                    self.show_skip_dialog()
+            elif self.skip_dialog and current_time >= self.marker.end:
+                if self.clock() - self.dialog_start_time >= self.dialog_display_duration:
+                    self.remove_skip_dialog()
             return
 
-        if self.intro_bookmark is not None and (self.intro_bookmark > 5):
-            xbmc.log('skipintro: Skip point is after 5% of video duration. Skipping disabled.', xbmc.LOGINFO)
+        # chapter bookmarks are percentages; the default delay is in seconds
+        if not self.using_default_skip and self.intro_bookmark is not None and (self.intro_bookmark > 5):
+            log.info('Skip point is after 5% of video duration. Skipping disabled.')
             return
 
         if self.using_default_skip:
@@ -185,14 +507,12 @@ class SkipIntroPlayer(xbmc.Player):
                     self.skip_to_intro_end()
                 elif not self.skip_dialog:
                     self.show_skip_dialog()
-        elif self.chapters:
+        elif self.timeline:
             previous_chapter = self.current_chapter
-            for i, chapter in enumerate(self.chapters):
-                if current_percentage >= chapter['start']:
-                    self.current_chapter = i + 1
+            self.current_chapter = self.timeline.chapter_at(current_time)
 
             if self.current_chapter != previous_chapter:
-                xbmc.log(f'skipintro: Current chapter: {self.current_chapter}', xbmc.LOGDEBUG)
+                log.debug('Current chapter: %d', self.current_chapter)
 
             # Show dialog at the start of chapter 2
             if self.current_chapter == 2 and not self.skip_dialog:
@@ -201,56 +521,278 @@ class SkipIntroPlayer(xbmc.Player):
             # Remove dialog at the start of chapter 3, but ensure it's shown for at least dialog_display_duration
             elif self.current_chapter == 3:
                 if self.skip_dialog:
-                    current_time = time.time()
+                    current_time = self.clock()
                     if current_time - self.dialog_start_time >= self.dialog_display_duration:
                         self.remove_skip_dialog()
                 else:
                     self.remove_skip_dialog()
 
+    def next_check_delay(self) -> Optional[float]:
+        """
+        Returns the seconds until check_chapter_and_prompt or the dialog
+        timeouts next have something to do, or None if nothing is pending
+        until the next playback event.
+        """
+        delays = []
+        if self.skip_dialog:
+            elapsed = self.clock() - self.dialog_start_time
+            delays.append(self.max_dialog_duration - elapsed)
+            if self.current_chapter == 3 or self.marker:
+                delays.append(self.dialog_display_duration - elapsed)
+            countdown = self._countdown(self.getTime()) if self.show_countdown and not self.paused else None
+            if countdown is not None:
+                # the next time the whole seconds on the button change
+                delays.append(self._wall_seconds(countdown - math.floor(countdown) or 1.0))
+
+        # playback positions only turn into wall time while playing
+        if self.awaiting_duration and not self.paused:
+            # nothing can be checked until the stream reports its duration
+            delays.append(DURATION_POLL)
+        elif not self.has_skipped and not self.paused and (
+            self.marker or self.using_default_skip or self.intro_bookmark is None or self.intro_bookmark <= 5
+        ):
+            current_time = self.getTime()
+            ahead = None
+            if self.marker:
+                for boundary in (self.marker.start, self.marker.end):
+                    if boundary > current_time:
+                        ahead = boundary - current_time
+                        break
+            elif self.using_default_skip:
+                if not self.skip_dialog:
+                    ahead = self.default_delay - self.seconds_before_skip - current_time
+            elif self.timeline:
+                # the next of chapters 2 and 3 still ahead of the playhead
+                chapter = max(self.timeline.chapter_at(current_time) + 1, 2)
+                if chapter <= min(3, len(self.timeline)):
+                    ahead = self.timeline.start(chapter) - current_time
+            if ahead is not None:
+                delays.append(ahead if ahead <= 0 else self._wall_seconds(ahead))
+            elif self.speed < 0:
+                # rewinding can cross back into the intro
+                delays.append(REWIND_POLL)
+
+        pending = [delay for delay in delays if delay > 0]
+        if delays and not pending:
+            return 0
+        return min(pending) if pending else None
+
+    def update(self) -> Optional[float]:
+        """
+        Runs the playback checks and returns the seconds until they next
+        need to run (None: not until the next playback event).
+        """
+        with self._lock:
+            if not self.isPlaying():
+                return None
+
+            self.check_chapter_and_prompt()
+
+            if self.skip_dialog:
+                current_time = self.clock()
+                if current_time - self.dialog_start_time > self.max_dialog_duration:
+                    self.remove_skip_dialog()
+                elif self.skip_dialog.button_pressed:
+                    self.skip_to_intro_end()
+                elif self.show_countdown:
+                    self.skip_dialog.set_countdown(self._countdown(self.getTime()))
+
+            return self.next_check_delay()
+
+    def _get_dialog(self) -> SkipIntroDialog:
+        """
+        Returns the cached dialog, building it first if there is none yet or
+        the screen resolution changed since it was laid out.
+        """
+        resolution = (xbmcgui.getScreenWidth(), xbmcgui.getScreenHeight())
+        if self.dialog_cache is None or resolution != self.dialog_resolution:
+            log.debug('Building skip intro dialog for %dx%d', resolution[0], resolution[1])
+            self.dialog_cache = SkipIntroDialog(on_close=self._wake_scheduler)
+            self.dialog_resolution = resolution
+        return self.dialog_cache
+
+    def _intro_end(self) -> Optional[float]:
+        """
+        Returns the playback time the intro ends at, if known.
+        """
+        if self.marker:
+            return self.marker.end
+        if self.using_default_skip:
+            return self.intro_bookmark + self.skip_duration
+        if self.timeline and len(self.timeline) >= 3:
+            return self.timeline.start(3)
+        return None
+
+    def _prompt_due(self) -> Optional[float]:
+        """
+        Returns the playback time the prompt is due at, if known.
+        """
+        if self.marker:
+            return self.marker.start
+        if self.using_default_skip:
+            return self.default_delay - self.seconds_before_skip
+        if self.timeline and len(self.timeline) >= 2:
+            return self.timeline.start(2)
+        return None
+
+    def _countdown(self, current_time: float) -> Optional[float]:
+        intro_end = self._intro_end() if self.show_countdown else None
+        if intro_end is None or intro_end <= current_time:
+            return None
+        return intro_end - current_time
+
     def show_skip_dialog(self):
-        xbmc.log('skipintro: Showing skip intro dialog', xbmc.LOGDEBUG)
-        self.skip_dialog = SkipIntroDialog()
-        self.skip_dialog.show()
-        self.dialog_start_time = time.time()
+        log.debug('Showing skip intro dialog')
+        started = time.perf_counter()
+        dialog = self._get_dialog()
+        self.prompt_time = self.getTime()
+        dialog.set_countdown(self._countdown(self.prompt_time))
+        dialog.show()
+        self.skip_dialog = dialog
+        self.dialog_start_time = self.clock()
+        elapsed = time.perf_counter() - started
+        self.time_to_visible.append(elapsed)
+        metrics.count('prompts')
+        metrics.observe('time_to_visible_seconds', elapsed)
+        # prompts a seek landed in the middle of say nothing about latency
+        due = self._prompt_due()
+        if due is not None and 0 <= self.prompt_time - due <= PROMPT_LATENCY_LIMIT:
+            metrics.observe('prompt_latency_seconds', self.prompt_time - due)
+        log.debug('Skip intro dialog visible after %.1f ms', elapsed * 1000)
 
     def remove_skip_dialog(self):
         if self.skip_dialog:
             self.skip_dialog.close()
             self.skip_dialog = None
-            xbmc.log('skipintro: Removed skip intro dialog', xbmc.LOGDEBUG)
+            log.debug('Removed skip intro dialog')
 
     def skip_to_intro_end(self):
-        if self.intro_bookmark is not None and not self.has_skipped:
-            if self.using_default_skip:
+        if (self.marker or self.intro_bookmark is not None) and not self.has_skipped:
+            if self.marker:
+                skip_to = self.marker.end
+            elif self.using_default_skip:
                 skip_to = self.intro_bookmark + self.skip_duration
             else:
-                skip_to = (self.intro_bookmark / 100) * self.getTotalTime()
-            xbmc.log(f'skipintro: Skipping intro to {skip_to:.2f} seconds', xbmc.LOGINFO)
+                skip_to = self.timeline.to_seconds(self.intro_bookmark)
+            log.info('Skipping intro to %.2f seconds', skip_to)
+
+            # a skip the user asked for confirms the intro; chapter skips are
+            # worth remembering too, the default delay is only a guess
+            confirmed = bool(self.skip_dialog and self.skip_dialog.button_pressed)
+            start = self.prompt_time if self.skip_dialog else self.getTime()
+            if confirmed:
+                self._learn_marker(start, skip_to, 'user', True)
+            elif not self.marker and not self.using_default_skip:
+                self._learn_marker(start, skip_to, 'chapters', False)
+
+            metrics.count('skips.user' if confirmed else 'skips.auto')
+            self.skip_target = skip_to
             self.seekTime(skip_to)
             self.remove_skip_dialog()
             self.has_skipped = True
         else:
-            xbmc.log('skipintro: No intro bookmark set to skip or already skipped', xbmc.LOGWARNING)
+            log.warning('No intro bookmark set to skip or already skipped')
+
+class PlaybackScheduler(threading.Thread):
+    """
+    Runs the player's checks only when something can happen: at the next
+    chapter boundary, skip point or dialog timeout, or right after a
+    playback event wakes it. Player callbacks can't interrupt
+    Monitor.waitForAbort, so the scheduler waits on its own event and the
+    service's main thread does the waitForAbort.
+    """
+
+    # upper bound on a single wait, in case a playback event is missed
+    max_wait: float = 60.0
+
+    def __init__(self, player: SkipIntroPlayer):
+        super().__init__(name='skipintro.scheduler', daemon=True)
+        self.player = player
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def step(self) -> float:
+        """
+        Runs the player's checks once and returns how long to wait before
+        the next run, unless a playback event wakes the scheduler sooner.
+        """
+        started = time.perf_counter()
+        try:
+            delay = self.player.update()
+        except Exception as e:
+            metrics.count('errors')
+            log.error('Unexpected error: %s', e)
+            delay = None
+        metrics.count('ticks')
+        metrics.observe('tick_seconds', time.perf_counter() - started)
+        timeout = self.max_wait if delay is None else min(delay, self.max_wait)
+        log.debug('Next check in %.2f seconds', timeout)
+        return timeout
+
+    def run(self):
+        while True:
+            self._wake.clear()
+            if self._stopped:
+                break
+            self._wake.wait(self.step())
+
+class SkipIntroMonitor(xbmc.Monitor):
+    """
+    Dumps the service's metrics and recent log events on request:
+
+        JSONRPC.NotifyAll {"sender": "plugin.video.skipintro", "message": "dump_diagnostics"}
+
+    writes diagnostics.json to the addon's profile and logs the counters.
+    """
+
+    def onNotification(self, sender, method, data):
+        if sender != addon.getAddonInfo('id') or not method.endswith('dump_diagnostics'):
+            return
+        try:
+            path = profile_path('diagnostics.json')
+            snapshot = diagnostics.write_report(path, metrics, log)
+        except Exception as e:
+            log.error('Cannot write diagnostics: %s', e)
+            return
+        log.info('Diagnostics written to %s: %s', path, snapshot['counters'])
 
 if __name__ == '__main__':
-    xbmc.log('skipintro: Starting SkipIntroPlayer', xbmc.LOGDEBUG)
+    refresh_log_level()
+    log.debug('Starting SkipIntroPlayer')
     skip_intro_player = SkipIntroPlayer()
-    monitor = xbmc.Monitor()
-
-    try:
-        while not monitor.abortRequested():
-            if skip_intro_player.isPlaying():
-                skip_intro_player.check_chapter_and_prompt()
-                
-                if skip_intro_player.skip_dialog:
-                    current_time = time.time()
-                    if current_time - skip_intro_player.dialog_start_time > skip_intro_player.max_dialog_duration:
-                        skip_intro_player.remove_skip_dialog()
-                    elif skip_intro_player.skip_dialog.button_pressed:
-                        skip_intro_player.skip_to_intro_end()
-            
-            xbmc.sleep(1000)  # Check every 1 second for less CPU usage
-    except Exception as e:
-        xbmc.log(f'skipintro: Unexpected error: {str(e)}', xbmc.LOGERROR)
-
-    xbmc.log('skipintro: SkipIntroPlayer stopped', xbmc.LOGDEBUG)
+    scheduler = PlaybackScheduler(skip_intro_player)
+    skip_intro_player.scheduler = scheduler
+    monitor = SkipIntroMonitor()
+
+    prescanner = None
+    if addon.getSettingBool('prescan_library') and skip_intro_player.marker_store is not None:
+        prescanner = Prescanner(
+            skip_intro_player.marker_store, unwatched_episodes, profile_path('prescan.json'),
+            log=log.info,
+        )
+        if skip_intro_player.isPlayingVideo():
+            prescanner.pause()
+        skip_intro_player.prescanner = prescanner
+
+    scheduler.start()
+    if prescanner:
+        prescanner.start()
+    monitor.waitForAbort()
+    scheduler.stop()
+    if prescanner:
+        prescanner.stop()
+        prescanner.join()
+    scheduler.join()
+    skip_intro_player.remove_skip_dialog()
+    skip_intro_player.dialog_cache = None
+    if skip_intro_player.marker_store is not None:
+        skip_intro_player.marker_store.close()
+
+    log.debug('SkipIntroPlayer stopped')
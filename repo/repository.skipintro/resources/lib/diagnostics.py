@@ -0,0 +1,158 @@
+"""
+Logging and runtime metrics for the skip service.
+
+Logger only formats a message when its level is enabled, so debug calls on
+the playback path cost a tuple append while debug logging is off. Every
+call, enabled or not, also goes into a ring buffer of recent events that
+is formatted only when it's dumped, which gives a field report the debug
+history without running with debug logging on.
+
+Metrics keeps counters and fixed-bucket histograms. Both can be dumped on
+demand with write_report.
+
+This module doesn't import xbmc: the service passes in xbmc.log and its
+levels.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Callable, Dict, List, Sequence
+
+DEBUG, INFO, WARNING, ERROR = range(4)
+LEVEL_NAMES = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+# bucket upper bounds, in seconds
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class Logger:
+    """
+    Writes messages of ``level`` and above to ``sink(message, sink_level)``
+    and keeps the last ``history`` calls of any level. Messages use
+    %-style arguments, formatted only when needed.
+    """
+
+    def __init__(self, sink: Callable[[str, int], None], sink_levels: Sequence[int] = (0, 1, 2, 3),
+                 prefix: str = '', level: int = INFO, history: int = 500,
+                 clock: Callable[[], float] = time.time):
+        self.sink = sink
+        self.sink_levels = sink_levels
+        self.prefix = prefix
+        self.level = level
+        self.clock = clock
+        self.events: deque = deque(maxlen=history)
+
+    def enabled_for(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, message: str, *args):
+        self.events.append((self.clock(), level, message, args))
+        if level >= self.level:
+            self.sink(self.prefix + (message % args if args else message), self.sink_levels[level])
+
+    def debug(self, message: str, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message: str, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message: str, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message: str, *args):
+        self.log(ERROR, message, *args)
+
+    def recent(self) -> List[str]:
+        """
+        Returns the ring buffer's events, oldest first, formatted.
+        """
+        lines = []
+        for timestamp, level, message, args in list(self.events):
+            try:
+                text = message % args if args else message
+            except (TypeError, ValueError):
+                text = f'{message} {args!r}'
+            clock = time.strftime('%H:%M:%S', time.localtime(timestamp))
+            lines.append(f'{clock}.{int(timestamp * 1000) % 1000:03d} {LEVEL_NAMES[level]:<7} {text}')
+        return lines
+
+
+class Histogram:
+    """
+    Counts observations into buckets with the given upper ``bounds``, plus
+    one for anything larger.
+    """
+
+    def __init__(self, bounds: Sequence[float] = SECONDS_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict:
+        if not self.count:
+            return {'count': 0}
+        labels = [f'<={bound:g}' for bound in self.bounds] + [f'>{self.bounds[-1]:g}']
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'max': self.max,
+            'buckets': {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class Metrics:
+    """
+    Counters and histograms, safe to update from the player's callbacks and
+    the scheduler at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Counter = Counter()
+        self.histograms: Dict[str, Histogram] = {}
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def observe(self, name: str, value: float, bounds: Sequence[float] = SECONDS_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(bounds)
+            histogram.observe(value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: h.snapshot() for name, h in sorted(self.histograms.items())},
+            }
+
+
+def write_report(path: str, metrics: Metrics, logger: Logger) -> Dict:
+    """
+    Writes the metrics and the recent events to the JSON file at ``path``
+    and returns the metrics snapshot.
+    """
+    snapshot = metrics.snapshot()
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'time': time.time(), 'metrics': snapshot, 'events': logger.recent()}, f, indent=1)
+    os.replace(tmp, path)
+    return snapshot
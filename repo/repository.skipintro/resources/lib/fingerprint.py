@@ -0,0 +1,262 @@
+"""
+Offline intro detection from audio fingerprints.
+
+The first minutes of each episode of a season are decoded to 8 kHz mono
+and turned into a compact fingerprint: one 32-bit word per 32 ms hop, each
+bit telling whether a frequency band is louder than the next one up.
+Episodes that share an intro share a run of near-identical words, so each
+episode is matched against its neighbours in the season: cross-correlating
+the two fingerprints' bit planes gives the time offset between them, and
+the longest stretch whose words still match at that offset is the intro.
+
+Decoding and fingerprinting run in a process pool. Results go into the
+MarkerStore, where SkipIntroPlayer picks them up at AV start.
+
+NumPy is needed to fingerprint, but not to import this module. WAV files
+are read directly; anything else is decoded by ffmpeg.
+
+    python -m resources.lib.fingerprint --db markers.db --show "Show" --season 1 S01E*.mkv
+"""
+
+import argparse
+import os
+import subprocess
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import markers
+
+SAMPLE_RATE = 8000
+FRAME_SIZE = 2048
+HOP_SIZE = 256
+HOP_SECONDS = HOP_SIZE / SAMPLE_RATE
+# 33 bands give the 32 band differences of a fingerprint word
+BAND_EDGES = (200.0, 3000.0)
+BANDS = 33
+# fingerprint words that differ in at most this many bits (averaged over a
+# second) count as the same audio; unrelated audio differs in about 16
+MAX_BIT_ERRORS = 8
+# how far, in standard deviations, the correlation peak must stand out
+MIN_PEAK_SCORE = 8.0
+# quiet or noisy moments inside an intro shorter than this don't split it
+MAX_GAP = 3.0
+MIN_INTRO = 10.0
+MAX_INTRO = 180.0
+
+Segment = Tuple[float, float]
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError('intro detection needs numpy')
+
+
+def decode(path: str, seconds: float) -> 'np.ndarray':
+    """
+    Returns the first ``seconds`` of a file's audio as 8 kHz mono int16.
+    """
+    _require_numpy()
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as f:
+            if f.getframerate() != SAMPLE_RATE or f.getnchannels() != 1 or f.getsampwidth() != 2:
+                raise ValueError(f'{path}: expected {SAMPLE_RATE} Hz mono 16-bit audio')
+            return np.frombuffer(f.readframes(int(seconds * SAMPLE_RATE)), dtype='<i2')
+    output = subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-t', str(seconds), '-i', path,
+         '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-'],
+        check=True, stdout=subprocess.PIPE).stdout
+    return np.frombuffer(output, dtype='<i2')
+
+
+def _band_matrix() -> 'np.ndarray':
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / SAMPLE_RATE)
+    edges = np.geomspace(BAND_EDGES[0], BAND_EDGES[1], BANDS + 1)
+    matrix = np.zeros((len(freqs), BANDS), dtype=np.float32)
+    for band in range(BANDS):
+        matrix[(freqs >= edges[band]) & (freqs < edges[band + 1]), band] = 1.0
+    return matrix
+
+
+def fingerprint(samples: 'np.ndarray', chunk: int = 512) -> 'np.ndarray':
+    """
+    Returns the uint32 fingerprint words of int16 ``samples``.
+    """
+    _require_numpy()
+    if len(samples) < FRAME_SIZE + HOP_SIZE:
+        return np.zeros(0, dtype=np.uint32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    bands = _band_matrix()
+    energies = np.empty((len(frames), BANDS), dtype=np.float32)
+    # in chunks, so the spectra of a long excerpt never sit in memory at once
+    for start in range(0, len(frames), chunk):
+        block = frames[start:start + chunk].astype(np.float32) * window
+        energies[start:start + chunk] = (np.abs(np.fft.rfft(block, axis=1)) ** 2) @ bands
+    bits = energies[:, :-1] > energies[:, 1:]
+    weights = np.left_shift(np.uint32(1), np.arange(BANDS - 1, dtype=np.uint32))
+    return (bits.astype(np.uint32) * weights).sum(axis=1, dtype=np.uint32)
+
+
+def fingerprint_file(path: str, seconds: float) -> 'np.ndarray':
+    return fingerprint(decode(path, seconds))
+
+
+def _popcount(words: 'np.ndarray') -> 'np.ndarray':
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[words.view(np.uint8)].reshape(-1, 4).sum(axis=1)
+
+
+def _bit_planes(words: 'np.ndarray') -> 'np.ndarray':
+    planes = ((words[:, None] >> np.arange(BANDS - 1, dtype=np.uint32)) & 1).astype(np.float32)
+    # centred, so bits that are nearly always set don't correlate everywhere
+    return planes - planes.mean(axis=0)
+
+
+def best_offset(a: 'np.ndarray', b: 'np.ndarray') -> Optional[int]:
+    """
+    Returns the offset d at which ``a[t]`` best matches ``b[t - d]``, from
+    the cross-correlation of their bit planes, or None when no offset
+    stands out.
+    """
+    if not len(a) or not len(b):
+        return None
+    size = 1 << (len(a) + len(b) - 1).bit_length()
+    spectrum = np.fft.rfft(_bit_planes(a), size, axis=0) * np.conj(np.fft.rfft(_bit_planes(b), size, axis=0))
+    correlation = np.fft.irfft(spectrum.sum(axis=1), size)
+    # lags -(len(b) - 1) .. len(a) - 1
+    lags = np.concatenate((correlation[size - len(b) + 1:], correlation[:len(a)]))
+    peak = int(np.argmax(lags))
+    spread = lags.std()
+    if not spread or (lags[peak] - np.median(lags)) / spread < MIN_PEAK_SCORE:
+        return None
+    return peak - len(b) + 1
+
+
+def _runs(mask: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray']:
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    return np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+
+
+def _longest_run(mask: 'np.ndarray', max_gap: int = 0) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (start, end) of the longest run of True in ``mask``, after
+    bridging gaps of up to ``max_gap`` between runs.
+    """
+    starts, ends = _runs(mask)
+    if not len(starts):
+        return None
+    if max_gap and len(starts) > 1:
+        mask = mask.copy()
+        for gap_start, gap_end in zip(ends[:-1], starts[1:]):
+            if gap_end - gap_start <= max_gap:
+                mask[gap_start:gap_end] = True
+        starts, ends = _runs(mask)
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest])
+
+
+def match(a: 'np.ndarray', b: 'np.ndarray') -> Optional[Tuple[Segment, Segment]]:
+    """
+    Returns the longest stretch of audio ``a`` and ``b`` share, as a
+    (start, end) in seconds in each, or None.
+    """
+    _require_numpy()
+    offset = best_offset(a, b)
+    if offset is None:
+        return None
+    start, end = max(0, offset), min(len(a), len(b) + offset)
+    if end - start <= 0:
+        return None
+    errors = _popcount(a[start:end] ^ b[start - offset:end - offset]).astype(np.float32)
+    width = max(1, int(round(1.0 / HOP_SECONDS)))
+    smoothed = np.convolve(errors, np.ones(width, dtype=np.float32) / width, mode='same')
+    run = _longest_run(smoothed <= MAX_BIT_ERRORS, int(MAX_GAP / HOP_SECONDS))
+    if run is None:
+        return None
+    first, last = start + run[0], start + run[1]
+    a_segment = (first * HOP_SECONDS, last * HOP_SECONDS)
+    b_segment = ((first - offset) * HOP_SECONDS, (last - offset) * HOP_SECONDS)
+    return a_segment, b_segment
+
+
+def _match_pair(pair: Tuple['np.ndarray', 'np.ndarray']):
+    return match(*pair)
+
+
+def detect_intros(fingerprints: Sequence['np.ndarray'], executor=None,
+                  min_length: float = MIN_INTRO, max_length: float = MAX_INTRO) -> List[Optional[Segment]]:
+    """
+    Matches each episode against the next one in the season (the last
+    against the first) and returns each episode's intro, or None. An
+    episode gets the longest segment of its two comparisons whose length
+    is within bounds.
+    """
+    count = len(fingerprints)
+    if count < 2:
+        return [None] * count
+    pairs = [(i, (i + 1) % count) for i in range(count if count > 2 else 1)]
+    jobs = [(fingerprints[i], fingerprints[j]) for i, j in pairs]
+    results = list(executor.map(_match_pair, jobs)) if executor else [match(*job) for job in jobs]
+
+    intros: List[Optional[Segment]] = [None] * count
+    for (i, j), result in zip(pairs, results):
+        if result is None:
+            continue
+        for episode, segment in ((i, result[0]), (j, result[1])):
+            length = segment[1] - segment[0]
+            if not min_length <= length <= max_length:
+                continue
+            current = intros[episode]
+            if current is None or length > current[1] - current[0]:
+                intros[episode] = segment
+    return intros
+
+
+def scan_season(paths: Sequence[str], seconds: float = 600, workers: int = 0) -> List[Optional[Segment]]:
+    """
+    Fingerprints the first ``seconds`` of every episode in ``paths`` and
+    returns their intros, in the same order.
+    """
+    _require_numpy()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return detect_intros([fingerprint_file(path, seconds) for path in paths])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        fingerprints = list(executor.map(fingerprint_file, paths, [seconds] * len(paths)))
+        return detect_intros(fingerprints, executor)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Detect the shared intro of a season\'s episodes.')
+    parser.add_argument('episodes', nargs='+', help='episode files of one season')
+    parser.add_argument('--db', required=True, help='marker database to write (the addon\'s markers.db)')
+    parser.add_argument('--show', help='show title, to also update the season\'s average')
+    parser.add_argument('--season', default='')
+    parser.add_argument('--minutes', type=float, default=10, help='how much of each episode to scan')
+    parser.add_argument('-j', '--workers', type=int, default=0, help='worker processes (default: all CPUs)')
+    args = parser.parse_args(argv)
+
+    intros = scan_season(args.episodes, args.minutes * 60, args.workers)
+    store = markers.MarkerStore(args.db)
+    series = markers.series_key(args.show, args.season)
+    try:
+        for path, intro in zip(args.episodes, intros):
+            if intro is None:
+                print(f'{path}: no intro found')
+                continue
+            store.put(markers.file_key(path, os.path.getsize(path)), intro[0], intro[1], series, 'audio')
+            print(f'{path}: intro {intro[0]:.2f}-{intro[1]:.2f}')
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Persistent store of learned intro markers.
+
+Markers are kept in a small sqlite database, keyed by file identity (file
+name and size, so the same episode is recognised on another share or after
+a rename of its folder) and aggregated per show and season, so a new
+episode of a known season gets a skip point before anything was learned
+about it. Both tables are bounded and evict their least recently used
+rows.
+
+This module doesn't import xbmc, so detectors and tools can fill the store
+outside Kodi.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Optional
+
+Marker = namedtuple('Marker', ['start', 'end', 'source', 'confirmed'])
+
+# how many samples a season's average remembers, so it follows a show
+# whose intro changes between episodes
+SERIES_WINDOW = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS markers (
+    file_key TEXT PRIMARY KEY,
+    series_key TEXT,
+    intro_start REAL NOT NULL,
+    intro_end REAL NOT NULL,
+    source TEXT NOT NULL,
+    confirmed INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS markers_last_used ON markers (last_used);
+CREATE TABLE IF NOT EXISTS series (
+    series_key TEXT PRIMARY KEY,
+    intro_start REAL NOT NULL,
+    intro_end REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS series_last_used ON series (last_used);
+"""
+
+
+def file_key(path: str, size: int) -> str:
+    return f'{os.path.basename(path.rstrip("/"))}:{size}'
+
+
+def series_key(show: str, season) -> Optional[str]:
+    if not show:
+        return None
+    return f'{show.strip().lower()}:{season}'
+
+
+class MarkerStore:
+    """
+    Intro markers in the sqlite database at ``path``, holding at most
+    ``max_entries`` files and as many seasons.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.clock = clock
+        # the player's callbacks and the scheduler share the connection
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(_SCHEMA)
+
+    def get(self, file: str, series: Optional[str] = None) -> Optional[Marker]:
+        """
+        Returns the file's own marker, else its season's average, else None.
+        """
+        now = self.clock()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT intro_start, intro_end, source, confirmed FROM markers WHERE file_key = ?',
+                (file,)).fetchone()
+            if row:
+                self._db.execute('UPDATE markers SET last_used = ? WHERE file_key = ?', (now, file))
+                return Marker(row[0], row[1], row[2], bool(row[3]))
+            if series is None:
+                return None
+            row = self._db.execute(
+                'SELECT intro_start, intro_end FROM series WHERE series_key = ?', (series,)).fetchone()
+            if row:
+                self._db.execute('UPDATE series SET last_used = ? WHERE series_key = ?', (now, series))
+                return Marker(row[0], row[1], 'series', False)
+        return None
+
+    def has(self, file: str) -> bool:
+        """
+        Returns whether the file has its own marker, without touching it.
+        """
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM markers WHERE file_key = ?', (file,)).fetchone() is not None
+
+    def put(self, file: str, start: float, end: float, series: Optional[str] = None,
+            source: str = 'chapters', confirmed: bool = False) -> bool:
+        """
+        Records a file's intro. A marker the user confirmed is only replaced
+        by another confirmed one. Each file counts once towards its season's
+        average: a new marker for it replaces its earlier one there. Returns
+        whether the marker was stored.
+        """
+        if end <= start:
+            return False
+        now = self.clock()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT confirmed, series_key, intro_start, intro_end FROM markers WHERE file_key = ?',
+                (file,)).fetchone()
+            if row and row[0] and not confirmed:
+                return False
+            self._db.execute(
+                'INSERT OR REPLACE INTO markers VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (file, series, start, end, source, int(confirmed), now))
+            if series is not None:
+                if row and row[1] == series:
+                    self._replace_sample(series, row[2], row[3], start, end, now)
+                else:
+                    self._add_sample(series, start, end, now)
+            self._evict('markers', 'file_key')
+            self._evict('series', 'series_key')
+        return True
+
+    def _add_sample(self, series: str, start: float, end: float, now: float):
+        row = self._db.execute(
+            'SELECT intro_start, intro_end, samples FROM series WHERE series_key = ?', (series,)).fetchone()
+        if row:
+            samples = min(row[2], SERIES_WINDOW - 1)
+            start = (row[0] * samples + start) / (samples + 1)
+            end = (row[1] * samples + end) / (samples + 1)
+            count = row[2] + 1
+        else:
+            count = 1
+        self._db.execute('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)',
+                         (series, start, end, count, now))
+
+    def _replace_sample(self, series: str, old_start: float, old_end: float,
+                        start: float, end: float, now: float):
+        row = self._db.execute(
+            'SELECT intro_start, intro_end, samples FROM series WHERE series_key = ?', (series,)).fetchone()
+        if not row:
+            # the season was evicted since; start it afresh
+            self._add_sample(series, start, end, now)
+            return
+        samples = min(row[2], SERIES_WINDOW)
+        self._db.execute(
+            'UPDATE series SET intro_start = ?, intro_end = ?, last_used = ? WHERE series_key = ?',
+            (row[0] + (start - old_start) / samples, row[1] + (end - old_end) / samples, now, series))
+
+    def _evict(self, table: str, key: str):
+        self._db.execute(
+            f'DELETE FROM {table} WHERE {key} IN ('
+            f'SELECT {key} FROM {table} ORDER BY last_used '
+            f'LIMIT max(0, (SELECT COUNT(*) FROM {table}) - ?))',
+            (self.max_entries,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM markers').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
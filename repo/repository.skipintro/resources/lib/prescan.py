@@ -0,0 +1,180 @@
+"""
+Background pre-scan of the library for intro markers.
+
+Detection at AV start runs while the box is busiest, so the service also
+walks the library in the background and stores markers ahead of time for
+episodes that haven't been watched yet. The scan is throttled, pauses
+while a video plays and checkpoints which files it has seen, so a restart
+carries on where it stopped instead of reading every sidecar again.
+
+This module doesn't import xbmc: the service passes in the library listing
+and tells the scanner when playback starts and stops.
+"""
+
+import json
+import os
+import queue
+import threading
+from typing import Callable, Iterable, Optional, Set, Tuple
+
+from . import markers, subtitles
+
+# (path, series key) of a library item
+Item = Tuple[str, Optional[str]]
+
+
+class Prescanner(threading.Thread):
+    """
+    Feeds the items from ``list_items`` to ``workers`` threads that detect
+    their intros and record them in ``store``. Each worker waits
+    ``throttle`` seconds between items. Progress is saved to the JSON file
+    at ``checkpoint`` every ``checkpoint_every`` items and when the scan
+    ends.
+    """
+
+    def __init__(self, store: markers.MarkerStore, list_items: Callable[[], Iterable[Item]],
+                 checkpoint: str, workers: int = 2, throttle: float = 0.5, checkpoint_every: int = 50,
+                 log: Callable[[str], None] = lambda message: None):
+        super().__init__(name='skipintro.prescan', daemon=True)
+        self.store = store
+        self.list_items = list_items
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.throttle = throttle
+        self.checkpoint_every = checkpoint_every
+        self.log = log
+        self.scanned = 0
+        self.found = 0
+        self._done: Set[str] = self._load_checkpoint()
+        self._done_lock = threading.Lock()
+        self._unsaved = 0
+        self._queue: 'queue.Queue[Optional[Tuple[str, str, Optional[str]]]]' = queue.Queue(maxsize=workers * 4)
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stopping = threading.Event()
+
+    def pause(self):
+        """
+        Holds the workers after their current item, e.g. while a video plays.
+        """
+        self._idle.clear()
+
+    def resume(self):
+        self._idle.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._idle.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._idle.is_set()
+
+    def _load_checkpoint(self) -> Set[str]:
+        try:
+            with open(self.checkpoint, encoding='utf-8') as f:
+                return set(json.load(f).get('done', []))
+        except (OSError, ValueError, AttributeError):
+            return set()
+
+    def save_checkpoint(self):
+        with self._done_lock:
+            done = sorted(self._done)
+            self._unsaved = 0
+        tmp = f'{self.checkpoint}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'done': done}, f)
+            os.replace(tmp, self.checkpoint)
+        except OSError as e:
+            self.log(f'Cannot save the pre-scan checkpoint: {str(e)}')
+
+    def _mark_done(self, key: str):
+        with self._done_lock:
+            self._done.add(key)
+            self._unsaved += 1
+            due = self._unsaved >= self.checkpoint_every
+        if due:
+            self.save_checkpoint()
+
+    def _wait_until_idle(self) -> bool:
+        """
+        Blocks while paused. Returns False once the scan is stopping.
+        """
+        while not self._idle.wait(1.0):
+            if self._stopping.is_set():
+                return False
+        return not self._stopping.is_set()
+
+    def _scan(self, path: str, key: str, series: Optional[str]):
+        sidecar = subtitles.find_sidecar(path)
+        intro = subtitles.detect(sidecar) if sidecar else None
+        stored = intro is not None and self.store.put(key, intro[0], intro[1], series, 'subtitles')
+        with self._done_lock:
+            self.scanned += 1
+            self.found += stored
+
+    def _work(self):
+        while True:
+            try:
+                job = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            if job is None or not self._wait_until_idle():
+                return
+            path, key, series = job
+            try:
+                self._scan(path, key, series)
+            except Exception as e:
+                self.log(f'Pre-scan of {path} failed: {str(e)}')
+            self._mark_done(key)
+            if self._stopping.wait(self.throttle):
+                return
+
+    def _pending(self) -> Iterable[Tuple[str, str, Optional[str]]]:
+        for path, series in self.list_items():
+            if self._stopping.is_set():
+                return
+            # sidecars are only read from local files
+            try:
+                key = markers.file_key(path, os.path.getsize(path))
+            except OSError:
+                continue
+            with self._done_lock:
+                if key in self._done:
+                    continue
+            if self.store.has(key):
+                self._mark_done(key)
+                continue
+            yield path, key, series
+
+    def _put(self, job) -> bool:
+        while not self._stopping.is_set():
+            try:
+                self._queue.put(job, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        threads = [threading.Thread(target=self._work, name=f'skipintro.prescan.{n}', daemon=True)
+                   for n in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for job in self._pending():
+                if not self._wait_until_idle() or not self._put(job):
+                    break
+        except Exception as e:
+            self.log(f'Pre-scan listing failed: {str(e)}')
+        finally:
+            # when stopping, the workers notice on their own
+            for _ in threads:
+                self._put(None)
+            for thread in threads:
+                thread.join()
+            self.save_checkpoint()
+            self.log(f'Pre-scan finished: {self.scanned} scanned, {self.found} intros found')
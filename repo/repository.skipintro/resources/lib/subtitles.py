@@ -0,0 +1,269 @@
+"""
+Intro detection from subtitle sidecar files.
+
+An intro is usually the first long stretch without dialogue near the start
+of an episode. SRT and ASS/SSA sidecars are parsed lazily, line by line,
+and parsing stops once the cues are past the opening minutes, so a file is
+never read in full. Cues that only carry music (lyrics marked with a note,
+[MUSIC] captions) don't count as dialogue.
+
+A batch mode scans a whole library in a thread pool and writes the intros
+to the MarkerStore, so SkipIntroPlayer has them at AV start:
+
+    python -m resources.lib.subtitles --db markers.db /path/to/library
+
+This module doesn't import xbmc. NumPy is used for the gap analysis when
+it's available.
+"""
+
+import argparse
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import markers
+
+SUBTITLE_EXTENSIONS = ('.srt', '.ass', '.ssa')
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.m4v', '.mov', '.ts', '.wmv', '.webm')
+MIN_INTRO = 20.0
+MAX_INTRO = 180.0
+# trimmed off both ends of a gap, so a skip never cuts into dialogue
+MARGIN = 1.0
+# cues can be slightly out of order, so parsing stops only after this many
+# in a row start past the scanned window
+LOOKAHEAD = 20
+
+Cue = Tuple[float, float]
+
+_SRT_TIME = re.compile(
+    r'(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})')
+_ASS_TIME = re.compile(r'(\d+):(\d{1,2}):(\d{1,2})[.](\d{1,3})')
+_ASS_TAGS = re.compile(r'\{[^}]*\}|\\[Nnh]')
+_MUSIC_ONLY = re.compile(r'^[\s♪♫#*~\-]*(\[[^\]]*music[^\]]*\]|\([^)]*music[^)]*\))?[\s♪♫#*~\-]*$', re.IGNORECASE)
+_EPISODE = re.compile(r'^(.*?)[\s._-]*[Ss](\d{1,2})[Ee]\d{1,3}')
+
+
+def _seconds(hours, minutes, seconds, fraction) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(fraction) / 10 ** len(fraction)
+
+
+def _is_dialogue(text: str) -> bool:
+    text = text.strip()
+    if not text:
+        return False
+    # lyrics are wrapped in notes; anything else with words is speech
+    if text.startswith(('♪', '♫', '#')) and text.rstrip().endswith(('♪', '♫', '#')):
+        return False
+    return not _MUSIC_ONLY.match(text)
+
+
+def _srt_cues(lines: Iterator[str]) -> Iterator[Tuple[float, float, str]]:
+    times = None
+    text = []
+    for line in lines:
+        match = _SRT_TIME.search(line)
+        if match:
+            times = (_seconds(*match.group(1, 2, 3, 4)), _seconds(*match.group(5, 6, 7, 8)))
+            text = []
+        elif not line.strip():
+            if times:
+                yield times[0], times[1], ' '.join(text)
+            times = None
+        elif times:
+            text.append(line.strip())
+    if times:
+        yield times[0], times[1], ' '.join(text)
+
+
+def _ass_cues(lines: Iterator[str]) -> Iterator[Tuple[float, float, str]]:
+    fields = None
+    in_events = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith('['):
+            in_events = line.lower() == '[events]'
+        elif not in_events:
+            continue
+        elif line.lower().startswith('format:'):
+            fields = [field.strip().lower() for field in line[len('format:'):].split(',')]
+        elif line.lower().startswith('dialogue:') and fields:
+            values = line[len('dialogue:'):].split(',', len(fields) - 1)
+            if len(values) != len(fields):
+                continue
+            event = dict(zip(fields, values))
+            start = _ASS_TIME.match(event.get('start', '').strip())
+            end = _ASS_TIME.match(event.get('end', '').strip())
+            if start and end:
+                yield (_seconds(*start.groups()), _seconds(*end.groups()),
+                       _ASS_TAGS.sub(' ', event.get('text', '')))
+
+
+def iter_cues(path: str, max_seconds: float) -> Iterator[Cue]:
+    """
+    Yields the (start, end) of the dialogue cues starting in the first
+    ``max_seconds`` of a subtitle file, reading no further than needed.
+    """
+    parse = _srt_cues if path.lower().endswith('.srt') else _ass_cues
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        late = 0
+        for start, end, text in parse(f):
+            if start > max_seconds:
+                late += 1
+                if late >= LOOKAHEAD:
+                    return
+                continue
+            late = 0
+            if _is_dialogue(text):
+                yield start, end
+
+
+def find_gap(cues: Sequence[Cue], min_length: float = MIN_INTRO, max_length: float = MAX_INTRO,
+             max_seconds: float = 600) -> Optional[Cue]:
+    """
+    Returns the first dialogue-free window of ``min_length`` to
+    ``max_length`` seconds, counting from the start of the file, that begins
+    in the first ``max_seconds``.
+    """
+    if not cues:
+        return None
+    cues = sorted(cues)
+    if np is not None:
+        starts = np.array([0.0] + [start for start, _ in cues])
+        # overlapping cues: a gap only starts after every earlier cue ended
+        ends = np.maximum.accumulate(np.array([0.0] + [end for _, end in cues]))
+        gaps = starts[1:] - ends[:-1]
+        candidates = np.nonzero((gaps >= min_length) & (gaps <= max_length) & (ends[:-1] <= max_seconds))[0]
+        if not len(candidates):
+            return None
+        first = int(candidates[0])
+        gap = (float(ends[first]), float(starts[first + 1]))
+    else:
+        gap = None
+        last_end = 0.0
+        for start, end in cues:
+            if min_length <= start - last_end <= max_length and last_end <= max_seconds:
+                gap = (last_end, start)
+                break
+            last_end = max(last_end, end)
+        if gap is None:
+            return None
+    start = gap[0] + MARGIN if gap[0] > 0 else 0.0
+    return start, gap[1] - MARGIN
+
+
+def detect(path: str, max_seconds: float = 600) -> Optional[Cue]:
+    """
+    Returns the intro found in a subtitle file, or None.
+    """
+    return find_gap(list(iter_cues(path, max_seconds)), max_seconds=max_seconds)
+
+
+def find_sidecar(video: str, names: Optional[Sequence[str]] = None) -> Optional[str]:
+    """
+    Returns the subtitle file next to ``video`` (``name.srt``,
+    ``name.en.srt``, ``name.ass``, ...), preferring an exact name match.
+    ``names`` can pass the folder's listing when it's already known.
+    """
+    folder, base = os.path.split(video)
+    stem = os.path.splitext(base)[0]
+    if names is None:
+        try:
+            names = os.listdir(folder or '.')
+        except OSError:
+            return None
+    matches = sorted(
+        name for name in names
+        if name.lower().endswith(SUBTITLE_EXTENSIONS)
+        and (os.path.splitext(name)[0] == stem or name.startswith(stem + '.')))
+    if not matches:
+        return None
+    exact = [name for name in matches if os.path.splitext(name)[0] == stem]
+    return os.path.join(folder, (exact or matches)[0])
+
+
+def guess_series(video: str) -> Optional[str]:
+    """
+    Returns the series key for a ``Show.Name.S01E02...`` file name, or None.
+    """
+    match = _EPISODE.match(os.path.basename(video))
+    if not match or not match.group(1):
+        return None
+    show = re.sub(r'[._]+', ' ', match.group(1)).strip()
+    return markers.series_key(show, int(match.group(2)))
+
+
+def find_episodes(root: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (video, subtitle) for every video under ``root`` with a sidecar.
+    """
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                sidecar = find_sidecar(os.path.join(folder, name), files)
+                if sidecar:
+                    yield os.path.join(folder, name), sidecar
+
+
+def _detect_episode(job: Tuple[str, str, float]) -> Tuple[str, Optional[Cue]]:
+    video, sidecar, max_seconds = job
+    try:
+        return video, detect(sidecar, max_seconds)
+    except OSError:
+        return video, None
+
+
+def scan_library(root: str, store: 'markers.MarkerStore', max_seconds: float = 600,
+                 workers: int = 8, force: bool = False) -> Dict[str, Optional[Cue]]:
+    """
+    Detects the intro of every episode under ``root`` that has a subtitle
+    sidecar and records it in ``store``. Episodes that already have a
+    marker are skipped unless ``force`` is set. Returns {video: intro}.
+    """
+    jobs = []
+    keys = {}
+    for video, sidecar in find_episodes(root):
+        try:
+            key = markers.file_key(video, os.path.getsize(video))
+        except OSError:
+            continue
+        if not force and store.has(key):
+            continue
+        keys[video] = key
+        jobs.append((video, sidecar, max_seconds))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for video, intro in executor.map(_detect_episode, jobs):
+            results[video] = intro
+            if intro is not None:
+                store.put(keys[video], intro[0], intro[1], guess_series(video), 'subtitles')
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Detect intros from subtitle sidecars across a library.')
+    parser.add_argument('library', help='folder to scan for videos with .srt/.ass sidecars')
+    parser.add_argument('--db', required=True, help='marker database to write (the addon\'s markers.db)')
+    parser.add_argument('--minutes', type=float, default=10, help='how much of each episode to consider')
+    parser.add_argument('-j', '--workers', type=int, default=8)
+    parser.add_argument('--force', action='store_true', help='redo episodes that already have a marker')
+    args = parser.parse_args(argv)
+
+    store = markers.MarkerStore(args.db)
+    try:
+        results = scan_library(args.library, store, args.minutes * 60, args.workers, args.force)
+    finally:
+        store.close()
+    for video, intro in sorted(results.items()):
+        print(f'{video}: ' + (f'intro {intro[0]:.2f}-{intro[1]:.2f}' if intro else 'no intro found'))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,140 @@
+import argparse
+import os
+import threading
 import time
-import subprocess
+import traceback
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+import build
+from _repo_generator import CACHE_DIR, IGNORE, KODI_VERSIONS, ArtifactStore, Generator
+
+ADDON_FOLDER = os.path.basename(os.path.dirname(build.ADDON_XML))
+
+
 class MyHandler(FileSystemEventHandler):
-    def on_modified(self, event):
-        if event.src_path.endswith('default.py'):
-            print(f'default.py has been modified. Running build.py...')
-            subprocess.run(['python', 'build.py'], check=True)
+    """
+    Collects the addon folders touched by filesystem events until the main
+    loop picks them up.
+    """
+
+    def __init__(self, releases):
+        self.releases = {os.path.abspath(release): release for release in releases}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+
+    def _addon_for(self, path):
+        path = os.path.abspath(path)
+        for root, release in self.releases.items():
+            if not path.startswith(root + os.sep):
+                continue
+            parts = os.path.relpath(path, root).split(os.sep)
+            # skip the generator's own output and anything it would skip
+            if parts[0] in ('zips', CACHE_DIR) or parts[0].startswith('.'):
+                return None
+            if any(p in IGNORE or 'pycache' in p.lower() for p in parts):
+                return None
+            if parts[-1].lower().endswith(('pyc', 'pyo')):
+                return None
+            return release, parts[0]
+        return None
+
+    def on_any_event(self, event):
+        # the generator's own reads show up as opened/closed events
+        if event.event_type not in ('created', 'deleted', 'modified', 'moved'):
+            return
+        # a folder's mtime changes with its entries, which get their own events
+        if event.is_directory and event.event_type == 'modified':
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            addon = self._addon_for(path) if path else None
+            if addon:
+                with self.lock:
+                    self.pending.add(addon)
+                self.changed.set()
+
+    def take(self, debounce):
+        """
+        Blocks until something changed and no further events arrived for
+        ``debounce`` seconds, then returns the changed (release, folder) pairs.
+        """
+        self.changed.wait()
+        while True:
+            self.changed.clear()
+            if not self.changed.wait(debounce):
+                break
+        with self.lock:
+            pending, self.pending = self.pending, set()
+        return pending
+
+    def requeue(self, changed):
+        """
+        Puts back (release, folder) pairs whose rebuild failed, so they're
+        rebuilt along with the next change.
+        """
+        with self.lock:
+            self.pending.update(changed)
+
+
+def rebuild(generators, store, changed):
+    start = time.perf_counter()
+    by_release = {}
+    for release, folder in changed:
+        by_release.setdefault(release, set()).add(folder)
+    for release, folders in by_release.items():
+        print(f'Rebuilding {", ".join(sorted(folders))} in {release}...')
+        generators[release].build(folders)
+    if ADDON_FOLDER in by_release.get('repo', ()):
+        publish()
+    # every saved edit leaves the previous zip behind in the store
+    store.prune([os.path.join(release, 'zips') for release in generators])
+    print(f'Rebuilt in {time.perf_counter() - start:.2f}s')
+
+
+def publish():
+    # build.py's stages after the generator, which already ran in-process
+    current_version = build.update_addon_xml(build.ADDON_XML)
+    if current_version is None:
+        return
+    state = build.load_state()
+    try:
+        for stage in build.pipeline(current_version):
+            if stage.name != 'repo_generator':
+                stage.run(state)
+    finally:
+        build.save_state(state)
+
 
 if __name__ == "__main__":
-    path = 'repo/repository.skipintro'
-    event_handler = MyHandler()
+    parser = argparse.ArgumentParser(description="Rebuild the repository when addon files change.")
+    parser.add_argument('--debounce', type=float, default=0.5,
+                        help="seconds without events before a rebuild starts (default: 0.5)")
+    args = parser.parse_args()
+
+    releases = [r for r in KODI_VERSIONS if os.path.exists(r)]
+    # one full build up front; the generators keep the repository state in memory
+    store = ArtifactStore(os.path.join(CACHE_DIR, 'store'))
+    generators = {release: Generator(release, store=store) for release in releases}
+
+    event_handler = MyHandler(releases)
     observer = Observer()
-    observer.schedule(event_handler, path, recursive=False)
+    for release in releases:
+        observer.schedule(event_handler, release, recursive=True)
     observer.start()
+    print(f'Watching {", ".join(releases)} for changes...')
 
     try:
         while True:
-            time.sleep(1)
+            changed = event_handler.take(args.debounce)
+            try:
+                rebuild(generators, store, changed)
+            except Exception:
+                # a bad save mustn't stop the watcher; the same folders are
+                # tried again with the next change
+                traceback.print_exc()
+                event_handler.requeue(changed)
+                print('Rebuild failed, still watching for changes...')
     except KeyboardInterrupt:
         observer.stop()
     observer.join()